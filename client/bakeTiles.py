@@ -0,0 +1,52 @@
+"""
+Bake world tiles for a seed ahead of a flight.
+
+Precomputes the chunk noise over a rectangle of chunks into tiles/<seed>.tiles,
+which WorldGen maps from disk instead of generating noise when the server
+hands out that seed:
+
+    python client/bakeTiles.py 123456 --radius 100
+    python client/bakeTiles.py 123456 --x0 -50 --y0 -20 --width 100 --height 40
+"""
+
+import argparse
+import os
+from time import perf_counter
+
+from worldgen import CLIENT_WORLD, WorldGen, tile_path, write_tiles
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("seeds", type=int, nargs="+")
+    parser.add_argument(
+        "--radius", type=int, default=64, help="chunks around the origin to bake"
+    )
+    parser.add_argument("--x0", type=int)
+    parser.add_argument("--y0", type=int)
+    parser.add_argument("--width", type=int)
+    parser.add_argument("--height", type=int)
+    parser.add_argument(
+        "--out",
+        default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "tiles"),
+    )
+    args = parser.parse_args()
+
+    x0 = args.x0 if args.x0 is not None else -args.radius
+    y0 = args.y0 if args.y0 is not None else -args.radius
+    width = args.width or 2 * args.radius + 1
+    height = args.height or 2 * args.radius + 1
+
+    for seed in args.seeds:
+        worldGen = WorldGen(**CLIENT_WORLD, seed=seed, tile_dir=None)
+        path = tile_path(args.out, seed)
+        start = perf_counter()
+        write_tiles(worldGen, x0, y0, width, height, path)
+        print(
+            f"Baked {width}x{height} chunks for seed {seed} into {path} "
+            f"in {perf_counter() - start:.1f}s"
+        )
+
+
+if __name__ == "__main__":
+    main()
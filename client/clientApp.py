@@ -1,5 +1,5 @@
-from json import dumps, loads
-from time import sleep, time
+from json import loads
+from time import perf_counter, sleep, time
 from direct.showbase.ShowBase import ShowBase
 from panda3d.core import *
 from screeninfo import get_monitors
@@ -25,10 +25,18 @@ import win32con
 import win32gui
 import win32api
 from win32controller import win32_WIN_Interface, win32_SYS_Interface
-from worldgen import WorldGen, WorldManager
+from worldgen import (
+    CLIENT_WORLD,
+    OBSTACLE_SPACING,
+    WorldGen,
+    WorldManager,
+    place_obstacles,
+)
 from direct.stdpy.threading import Thread
-import random
+from collections import OrderedDict, deque
 from physics import physicsMgr
+from spatial import CellIndex
+from instancing import obstacleInstancer, makeBakedPrototype, setBakedCenter
 
 import numpy as np
 from scipy.stats import norm
@@ -71,9 +79,19 @@ def map_weights_to_range(obj_percent_list):
     return results
 
 
+# Placed obstacles that pull the ship in: acceleration per physics tick at the
+# centre and the distance at which it has halved
+gravity_wells = {
+    "black_hole": (0.004, 120),
+    "wormhole": (0.002, 50),
+    "solar_system": (0.001, 15),
+}
+
+
 # local imports
 from socketClient import (
     start_client,
+    MSG,
     send_message,
     iter_messages,
     search_servers,
@@ -133,7 +151,7 @@ class clientProgram(ShowBase):
         self.backfaceCullingOn()
         self.render.set_antialias(AntialiasAttrib.MAuto)
         self.physicsMgr = physicsMgr()
-        self.physicsMgr.enable(drag=0.0003, gravity=(0, 0, 0))
+        self.physicsMgr.enable(drag=0.0003, gravity=(0, 0, 0), stepHz=60)
         register_disconnect_callback(lambda: os.kill(os.getpid(), 9))
         filterMgr = CommonFilters(self.win, self.cam)
         filterMgr.setMSAA(2)
@@ -190,15 +208,19 @@ class clientProgram(ShowBase):
         )
         self.serverButtonsOffset = 0
         self.serverButtons = []
-        self.worldGen = WorldGen(
-            threshold=-1,
-            chunk_size=6,
-            voxel_scale=1,
-            noise_scale=1,
-            seed=0,
-        )
+        self.worldGen = WorldGen(**CLIENT_WORLD, seed=0)
         self.obstaclesToPlace = []
         self.targetsToPlace = []
+        # Camera zoom per 60 Hz frame from the newest thruster reading
+        self.thrusterZoom = 0
+        self.messageHandlers = {
+            MSG.CLIENT_CONFIG: self.runConfig,
+            MSG.BUILD_WORLD: lambda payload: self.build_world(),
+            MSG.START_SIMULATION: lambda payload: self.start_simulation(),
+            MSG.UPDATE_THORIUM_SHIP_POSITION: self.update_thruster_position,
+            MSG.QUIT: lambda payload: self.quit(),
+            MSG.NEW_OBJECT: self.create_new_object,
+        }
 
     def launch(self, serverName):
         threading.Thread(target=start_client, args=(serverName,)).start()
@@ -206,10 +228,8 @@ class clientProgram(ShowBase):
         self.serverListPanel.destroy()
         [button.destroy() for button in self.serverButtons]
         self.taskMgr.add(self.server_loop, "server_loop")
-        send_message(
-            "CLIENT_INIT",
-        )
-        send_message("CLIENT_INFO||+MONITOR_CONFIG||+" + dumps(generate_monitor_list()))
+        send_message(MSG.CLIENT_INIT)
+        send_message(MSG.CLIENT_INFO, ("MONITOR_CONFIG", generate_monitor_list()))
         self.alert = OnscreenText(
             parent=self.aspect2d,
             text="Initializing client, please continue on the server side...",
@@ -221,24 +241,17 @@ class clientProgram(ShowBase):
 
     def quit(self):
         print("Exiting client program...")
+        if hasattr(self, "WorldManager"):
+            self.WorldManager.shutdown()
         self.userExit()
 
     def server_loop(self, task):
-        for message in iter_messages():
-            if message.startswith("CLIENT_CONFIG"):
-                self.runConfig(message.split("||+")[1])
-            elif message == "BUILD_WORLD":
-                self.build_world()
-            elif message == "START_SIMULATION":
-                self.start_simulation()
-            elif message.startswith("UPDATE_THORIUM_SHIP_POSITION"):
-                self.update_thruster_position(message.split("||+")[1])
-            elif message == "QUIT":
-                self.quit()
-            elif message.startswith("NEW_OBJECT"):
-                self.create_new_object(loads(message.split("||+")[1]))
-            else:
-                print(f"CLIENT: Received unknown message: {message}")
+        for msgType, payload in iter_messages():
+            handler = self.messageHandlers.get(msgType)
+            if handler is None:
+                print(f"CLIENT: Received unknown message: {msgType!r}")
+                continue
+            handler(payload)
         return task.cont
 
     def build_world(self):
@@ -262,7 +275,7 @@ class clientProgram(ShowBase):
         self.voyager_model.setScale(0.1)
         self.rootNode = self.render.attachNewNode("rootNode")
         self.voyager_model.reparentTo(self.rootNode)
-        self.physicsMgr.registerObject(
+        self.shipBody = self.physicsMgr.registerObject(
             object=self.rootNode,
             name="ship",
             velocity=[0, 0, 0],
@@ -330,9 +343,51 @@ class clientProgram(ShowBase):
             WorldGen=self.worldGen,
             renderObject=self.rootNode,
             renderDistance=3,
-            scale_multiplier=1 / self.worldGen.VOX_SC,
+            # Chunks are windowed in the space obstacles are placed in
+            scale_multiplier=1 / (OBSTACLE_SPACING * self.worldGen.VOX_SC),
+            # Jobs are a few ms each and every worker re-imports clientApp
+            # when spawned on Windows, a couple of them is plenty
+            workers=2,
         )
-        self.renderedChunks = set()
+        # Voxel cells that already got their obstacle, packed into int64 keys
+        self.renderedChunks = CellIndex()
+        # One parent node per loaded chunk; unloaded chunks wait detached in a
+        # small pool so flying back over them does not rebuild them
+        self.terrainNode = self.render.attachNewNode("terrainNode")
+        self.chunkNodes = {}
+        self.chunkNodePool = OrderedDict()
+        self.chunkPoolSize = 32
+        self.chunkPoints = {}
+        self.reportedChunks = set()
+        # (command, chunk, placement) from the terrain thread, applied to the
+        # scene on the main thread by drainSceneCommands
+        self.sceneCommands = deque()
+        self.sceneBudgetMs = 4
+        # How procedural obstacles are drawn: "instanced" uses one instanced
+        # geom per type, "flattened" merges each chunk's obstacles into one
+        # geom once the chunk is placed, like serverApp does for its map
+        # nodes, and "copies" keeps a copyTo per obstacle
+        self.obstacleMode = "instanced"
+        self.obstacleInstancers = {}
+        self.bakedPrototypes = {}
+        if self.obstacleMode == "instanced":
+            self.instancedShader = Shader.load(
+                Shader.SL_GLSL,
+                "shaders/fadeInstanced.vert",
+                "shaders/fadeInstanced.frag",
+            )
+            for _, _, model in self.object_ranges:
+                self.obstacleInstancers[model.getName()] = obstacleInstancer(
+                    model, self.terrainNode, self.instancedShader
+                )
+        elif self.obstacleMode == "flattened":
+            self.bakedShader = Shader.load(
+                Shader.SL_GLSL,
+                "shaders/fadeBaked.vert",
+                "shaders/fadeInstanced.frag",
+            )
+            for _, _, model in self.object_ranges:
+                self.bakedPrototypes[model.getName()] = makeBakedPrototype(model)
         self.render.hide()
 
         # List containing objects and their percentage chance of spawning
@@ -342,8 +397,9 @@ class clientProgram(ShowBase):
                 sleep(1 / 20)
 
         Thread(target=renderTerrainThread).start()
+        self.taskMgr.add(self.drainSceneCommands, "drainSceneCommands")
         self.alert.destroy()
-        send_message("CLIENT_READY")
+        send_message(MSG.CLIENT_READY)
         for obstacle in self.obstaclesToPlace:
             if obstacle["name"] == "black_hole":
                 instance = self.blackHoleModel.copyTo(self.render)
@@ -381,29 +437,28 @@ class clientProgram(ShowBase):
             instance.setShaderInput("fadeColor", Vec4(*obstacle["color"]))
             instance.setName(obstacle["name"])
             instance.setTransparency(TransparencyAttrib.MAlpha)
-            send_message("NEW_OBJECT||+" + dumps(obstacle))
+            self.addGravityWell(instance, obstacle["name"])
+            send_message(MSG.NEW_OBJECT, obstacle)
         send_message(
-            "NEW_OBJECT||+"
-            + dumps(
-                {
-                    "position": list(self.voyager_model.getPos()),
-                    "rotation": [0, 0, 0],
-                    "hitbox_scale": [1, 1, 1],
-                    "hitbox_offset": [0, 0, 0],
-                    "hitbox_type": "sphere",
-                    "hitbox_geom": None,
-                    "size": list(self.voyager_model.getScale()),
-                    "id": "ship",
-                    "name": "ship",
-                    "color": [1, 1, 1, 1],
-                    "colorScale": [1, 1, 1, 1],
-                    "texture": None,
-                    "texData": None,
-                    "onHit": None,
-                    "visible": True,
-                    "colidable": True,
-                }
-            )
+            MSG.NEW_OBJECT,
+            {
+                "position": list(self.voyager_model.getPos()),
+                "rotation": [0, 0, 0],
+                "hitbox_scale": [1, 1, 1],
+                "hitbox_offset": [0, 0, 0],
+                "hitbox_type": "sphere",
+                "hitbox_geom": None,
+                "size": list(self.voyager_model.getScale()),
+                "id": "ship",
+                "name": "ship",
+                "color": [1, 1, 1, 1],
+                "colorScale": [1, 1, 1, 1],
+                "texture": None,
+                "texData": None,
+                "onHit": None,
+                "visible": True,
+                "colidable": True,
+            },
         )
 
     def start_simulation(self):
@@ -416,7 +471,11 @@ class clientProgram(ShowBase):
         print("CLIENT: Rendering in progress")
 
     def update(self, task):
-        self.physicsMgr.updateWorldPositions()
+        dt = self.clock.getDt()
+        self.physicsMgr.updateWorldPositions(dt)
+        yVal = self.camera.getY() + self.thrusterZoom * dt * 60
+        if -10 >= yVal >= -100:
+            self.camera.setPos(0, yVal, 0)
         rotVal = self.engineRingNode.getH()
         strength = self.engineRingNode.getColorScale()[3]
         # Get x and y components from rotVal (assuming rotVal is in degrees)
@@ -424,21 +483,22 @@ class clientProgram(ShowBase):
         x_component = math.cos(rot_rad)
         y_component = math.sin(rot_rad)
         if strength > 0:
-            if tuple(self.physicsMgr.getObjectVelocity(self.rootNode, "ship")) <= (
+            if tuple(self.physicsMgr.getObjectVelocity(self.shipBody, "ship")) <= (
                 0.001,
                 0.001,
                 0.001,
             ):
                 self.physicsMgr.setObjectVelocity(
-                    self.rootNode, "ship", [x_component, y_component, 0]
+                    self.shipBody, "ship", [x_component, y_component, 0]
                 )
             else:
                 self.physicsMgr.addVectorForce(
-                    self.rootNode,
+                    self.shipBody,
                     "ship",
                     [
-                        x_component * strength * 0.001,
-                        y_component * strength * 0.001,
+                        # Thrust is tuned per 60 Hz frame, scale it to this frame
+                        x_component * strength * 0.001 * dt * 60,
+                        y_component * strength * 0.001 * dt * 60,
                         0,  # No vertical force
                     ],
                 )
@@ -469,101 +529,154 @@ class clientProgram(ShowBase):
         instance.setShaderInput("fadeCenter", position)
         instance.setShaderInput("fadeDistance", instance.getScale(self.render)[0])
         instance.setTransparency(TransparencyAttrib.MAlpha)
+        self.addGravityWell(instance, data["name"])
         data["size"] = list(instance.getScale(self.render))
         data["position"] = list(position)
         data["rotation"] = list(rotation)
         data["color"] = list(instance.getColor())
         data["colorScale"] = list(instance.getColorScale())
-        send_message(
-            "NEW_OBJECT||+" + dumps(data),
-        )
+        send_message(MSG.NEW_OBJECT, data)
+
+    def addGravityWell(self, instance, name):
+        if name in gravity_wells:
+            strength, falloff = gravity_wells[name]
+            self.physicsMgr.registerForceField(
+                object=instance,
+                name=name + str(len(self.physicsMgr.forceFields)),
+                strength=strength,
+                falloff=falloff,
+            )
 
     def renderTerrain(self):
+        # Runs on the terrain thread: generate chunks and work out placement,
+        # but leave every scene graph change to drainSceneCommands
         self.WorldManager.update()
-        newChunks = self.WorldManager.newChunks - self.WorldManager.lastNewChunks
-
-        for chunk in newChunks:
-            xCoord, yCoord = chunk
-            chunkData = self.worldGen.GENERATED_CHUNKS[chunk]
-            arr = np.array(chunkData)
-            xs = arr[:, 0]
-            ys = arr[:, 1]
-            points = arr[:, 2]
-            coords3D = np.stack(
-                [
-                    xCoord * self.worldGen.CHUNK_SIZE + xs,
-                    yCoord * self.worldGen.CHUNK_SIZE + ys,
-                    np.zeros_like(xs),
-                ],
-                axis=1,
-            )
-            pointIndices = (points + 1) / 2
-
-            coords3D_tuples = [tuple(coord) for coord in coords3D]
-            not_rendered_mask = [
-                tuple(coord) not in self.renderedChunks for coord in coords3D
-            ]
-            coords3D = coords3D[not_rendered_mask]
-            pointIndices = pointIndices[not_rendered_mask]
-            coords3D_tuples = [tuple(coord) for coord in coords3D]
-
-            for i, coord3D in enumerate(coords3D):
-                pointIndex = pointIndices[i]
-                for start, end, model in self.object_ranges:
-                    if start <= pointIndex < end:
-                        instance = model.copyTo(self.render)
-                        offset = (
-                            10
-                            + (
-                                self.worldGen.get_noise_point(
-                                    coord3D[0] * 100,
-                                    coord3D[1] * 100,
-                                    0,
-                                    self.worldGen.seed,
-                                )
-                                + 2
-                            )
-                            * 50
-                        )
-                        instancePos = Vec3(
-                            (coord3D[0] * 25) + offset,
-                            (coord3D[1] * 25) + coord3D[1] % offset / 20,
-                            random.uniform(
-                                -0.5, 0.5
-                            ),  # Increased Z offset to avoid z-fighting
-                        )
+        for event, chunk in self.WorldManager.popChunkEvents():
+            if event == "load":
+                pooled = chunk in self.chunkNodePool
+                placement = None if pooled else self.placeChunk(chunk)
+                self.sceneCommands.append(("spawn", chunk, placement))
+            else:
+                self.sceneCommands.append(("despawn", chunk, None))
+
+    def drainSceneCommands(self, task):
+        # Spend at most sceneBudgetMs per frame, the rest waits its turn
+        deadline = perf_counter() + self.sceneBudgetMs / 1000
+        while self.sceneCommands and perf_counter() < deadline:
+            command, chunk, placement = self.sceneCommands.popleft()
+            if command == "spawn":
+                self.loadChunk(chunk, placement)
+            else:
+                self.unloadChunk(chunk)
+        for instancer in self.obstacleInstancers.values():
+            instancer.flush()
+        return task.cont
+
+    def unloadChunk(self, chunk):
+        chunkNode = self.chunkNodes.pop(chunk, None)
+        if chunkNode is None:
+            return
+        chunkNode.detachNode()
+        for instancer in self.obstacleInstancers.values():
+            instancer.hideInstances(chunk)
+        self.chunkNodePool[chunk] = chunkNode
+        while len(self.chunkNodePool) > self.chunkPoolSize:
+            oldChunk, oldNode = self.chunkNodePool.popitem(last=False)
+            oldNode.removeNode()
+            for instancer in self.obstacleInstancers.values():
+                instancer.removeInstances(oldChunk)
+            oldCells = self.chunkPoints.pop(oldChunk, None)
+            if oldCells is not None:
+                self.renderedChunks.discard(oldCells)
+
+    def placeChunk(self, chunk):
+        """World coordinates, obstacle positions and spawn indices of every
+        point of a generated chunk, computed without touching the scene"""
+        return place_obstacles(
+            chunk, self.worldGen.GENERATED_CHUNKS[chunk], self.worldGen.CHUNK_SIZE
+        )
+
+    def loadChunk(self, chunk, placement=None):
+        if chunk in self.chunkNodes:
+            return
+        chunkNode = self.chunkNodePool.pop(chunk, None)
+        if chunkNode is not None:
+            chunkNode.reparentTo(self.terrainNode)
+            self.chunkNodes[chunk] = chunkNode
+            for instancer in self.obstacleInstancers.values():
+                instancer.showInstances(chunk)
+            return
+        xCoord, yCoord = chunk
+        chunkNode = self.terrainNode.attachNewNode(f"chunk_{xCoord}_{yCoord}")
+        self.chunkNodes[chunk] = chunkNode
+        flatten = self.obstacleMode == "flattened"
+        if flatten:
+            chunkNode.setShader(self.bakedShader)
+            chunkNode.setTransparency(TransparencyAttrib.MAlpha)
+        # The server keeps every object it was told about, only report once
+        report = chunk not in self.reportedChunks
+        self.reportedChunks.add(chunk)
+
+        # Placed on the terrain thread, unless the chunk left the node pool
+        # after the spawn command was queued
+        if placement is None:
+            placement = self.placeChunk(chunk)
+        coords3D, positions, pointIndices = placement
+
+        cells = np.rint(coords3D).astype(np.int64)
+        not_rendered_mask = ~self.renderedChunks.contains(cells)
+        cells = cells[not_rendered_mask]
+        pointIndices = pointIndices[not_rendered_mask]
+        positions = positions[not_rendered_mask]
+
+        instancePositions = {name: [] for name in self.obstacleInstancers}
+        for i, pointIndex in enumerate(pointIndices):
+            for start, end, model in self.object_ranges:
+                if start <= pointIndex < end:
+                    instancePos = Vec3(*positions[i])
+                    if model.getName() in instancePositions:
+                        instancePositions[model.getName()].append(instancePos)
+                    elif flatten:
+                        prototype = self.bakedPrototypes[model.getName()]
+                        instance = prototype.copyTo(chunkNode)
+                        instance.setPos(instancePos)
+                        setBakedCenter(instance, instancePos)
+                    else:
+                        instance = model.copyTo(chunkNode)
                         instance.setPos(instancePos)
                         instance.setShaderInput("fadeCenter", instancePos)
                         instance.setTransparency(TransparencyAttrib.MAlpha)
 
+                    if report:
                         send_message(
-                            "NEW_OBJECT||+"
-                            + dumps(
-                                {
-                                    "position": list(instancePos),
-                                    "rotation": [0, 0, 0],
-                                    "hitbox_scale": [1, 1, 1],
-                                    "hitbox_offset": [0, 0, 0],
-                                    "hitbox_type": "sphere",
-                                    "hitbox_geom": None,
-                                    "size": list(model.getScale()),
-                                    "id": "obstacle",
-                                    "name": str(model.getName()),
-                                    "color": list(model.getColor()),
-                                    "colorScale": [1, 1, 1, 1],
-                                    "texture": None,
-                                    "texData": None,
-                                    "onHit": None,
-                                    "visible": True,
-                                    "colidable": True,
-                                }
-                            )
+                            MSG.NEW_OBJECT,
+                            {
+                                "position": list(instancePos),
+                                "rotation": [0, 0, 0],
+                                "hitbox_scale": [1, 1, 1],
+                                "hitbox_offset": [0, 0, 0],
+                                "hitbox_type": "sphere",
+                                "hitbox_geom": None,
+                                "size": list(model.getScale()),
+                                "id": "obstacle",
+                                "name": str(model.getName()),
+                                "color": list(model.getColor()),
+                                "colorScale": [1, 1, 1, 1],
+                                "texture": None,
+                                "texData": None,
+                                "onHit": None,
+                                "visible": True,
+                                "colidable": True,
+                            },
                         )
-                        break
-                self.renderedChunks.add(coords3D_tuples[i])
-            sleep(1 / 10)
-
-        self.WorldManager.lastNewChunks = self.WorldManager.newChunks.copy()
+                    break
+        for name, placed in instancePositions.items():
+            if placed:
+                self.obstacleInstancers[name].addInstances(chunk, placed)
+        if flatten:
+            chunkNode.flattenStrong()
+        self.renderedChunks.add(cells)
+        self.chunkPoints[chunk] = cells
 
     def generateGrid(self, grid_size=100, spacing=10):
         self.gridNode = self.render.attachNewNode("gridNode")
@@ -621,8 +734,8 @@ class clientProgram(ShowBase):
                 )
             )
             send_message(
-                "CLIENT_INFO||+MONITOR_INDEX||+"
-                + str(self.win_interface.getWindowMonitor())
+                MSG.CLIENT_INFO,
+                ("MONITOR_INDEX", self.win_interface.getWindowMonitor()),
             )
         if config.startswith("set_ship_"):
             ship_data = loads(config.split("set_ship_")[-1])
@@ -640,8 +753,7 @@ class clientProgram(ShowBase):
             try:
                 self.seed = int(config.split("set_seed_")[-1])
                 self.worldGen.set_seed(self.seed)
-                random.seed(self.seed)
-                send_message("CLIENT_INFO||+SEED||+" + str(self.seed))
+                send_message(MSG.CLIENT_INFO, ("SEED", self.seed))
             except Exception as e:
                 print(f"Error setting seed: {e}")
         if config.startswith("set_obstacles_"):
@@ -661,31 +773,28 @@ class clientProgram(ShowBase):
 
     def updateServerPositionData(self, task):
         send_message(
-            "UPDATE_DATA||+"
-            + dumps(
-                {
-                    "ship": {
-                        "pos": [
-                            self.rootNode.getX(),
-                            self.rootNode.getY(),
-                            self.rootNode.getZ(),
-                        ],
-                        "rot": [
-                            self.camera_joint.getH(),
-                            self.camera_joint.getP(),
-                            self.camera_joint.getR(),
-                        ],
-                    }
+            MSG.UPDATE_DATA,
+            {
+                "ship": {
+                    "pos": [
+                        self.rootNode.getX(),
+                        self.rootNode.getY(),
+                        self.rootNode.getZ(),
+                    ],
+                    "rot": [
+                        self.camera_joint.getH(),
+                        self.camera_joint.getP(),
+                        self.camera_joint.getR(),
+                    ],
                 }
-            )
+            },
         )
         return task.again
 
     def update_thruster_position(self, data):
-        data = loads(data)
-        yVal = -data[0]["z"] * 0.3 + self.camera.getY()
-        if -10 >= yVal >= -100:
-            self.camera.setPos(0, yVal, 0)
+        # Applied per frame in update, thruster messages are latest-value and
+        # may arrive several or none per frame
+        self.thrusterZoom = -data[0]["z"] * 0.3
         # Clamp pitch to [-45, 45], wrap yaw to [0, 360)
         # If you want pitch to be only [0, 45] and [315, 360], remap accordingly:
         pitch = data[1]["pitch"] % 360
@@ -0,0 +1,192 @@
+"""
+Batched drawing for procedural obstacles.
+
+Instancing: every obstacle of one type is drawn from a single copy of its
+model. The placement of each instance lives in a buffer texture that
+shaders/fadeInstanced.vert reads by gl_InstanceID, so a type costs one draw
+call however many obstacles are loaded.
+
+Baking: obstacles are copied from a prototype whose fade settings live in
+vertex columns instead of shader inputs, so a chunk of them can be merged
+into a single geom with flattenStrong and drawn by shaders/fadeBaked.vert.
+"""
+
+import numpy as np
+from panda3d.core import (
+    Geom,
+    GeomEnums,
+    GeomVertexArrayFormat,
+    GeomVertexFormat,
+    InternalName,
+    NodePath,
+    OmniBoundingVolume,
+    Texture,
+)
+
+# Texels per instance: (x, y, z, scale), fade color, (fade distance, 0, 0, 0)
+TEXELS_PER_INSTANCE = 3
+
+
+def _fadeDistance(model):
+    # Keep the ShaderInput alive, getVector() points into it
+    shaderInput = model.getShaderInput("fadeDistance")
+    return float(shaderInput.getVector()[0])
+
+
+class obstacleInstancer:
+    def __init__(self, model, parent, shader, capacity=256):
+        """Draw instances of `model` under `parent`; the model's scale,
+        color and fadeDistance input are the defaults for new instances"""
+        self.scale = model.getScale()[0]
+        self.color = tuple(model.getColor())
+        self.fadeDistance = _fadeDistance(model)
+
+        self.node = model.copyTo(parent)
+        self.node.setScale(1)
+        self.node.flattenStrong()
+        self.node.setShader(shader)
+        # Instances are spread over the whole world, never cull the geom
+        for geomNode in self.node.findAllMatches("**/+GeomNode"):
+            geomNode.node().setBounds(OmniBoundingVolume())
+            geomNode.node().setFinal(True)
+        self.node.hide()
+
+        self.texture = Texture("instanceData_" + model.getName())
+        self.capacity = 0
+        self.buffer = np.zeros((0, TEXELS_PER_INSTANCE, 4), dtype=np.float32)
+        self._grow(capacity)
+        self.node.setShaderInput("instanceData", self.texture)
+
+        self.groups = {}
+        self.hiddenGroups = set()
+        self.instanceCount = 0
+        self.dirty = False
+
+    def _grow(self, capacity):
+        self.capacity = capacity
+        self.buffer = np.zeros((capacity, TEXELS_PER_INSTANCE, 4), dtype=np.float32)
+        self.texture.setupBufferTexture(
+            capacity * TEXELS_PER_INSTANCE,
+            Texture.T_float,
+            Texture.F_rgba32,
+            GeomEnums.UH_dynamic,
+        )
+
+    def addInstances(
+        self, key, positions, scales=None, colors=None, fadeDistances=None
+    ):
+        """Set the instances drawn for `key` (usually a chunk coordinate),
+        replacing any it already had"""
+        positions = np.asarray(positions, dtype=np.float32).reshape(-1, 3)
+        block = np.zeros((len(positions), TEXELS_PER_INSTANCE, 4), dtype=np.float32)
+        block[:, 0, :3] = positions
+        block[:, 0, 3] = self.scale if scales is None else scales
+        block[:, 1] = self.color if colors is None else colors
+        block[:, 2, 0] = self.fadeDistance if fadeDistances is None else fadeDistances
+        self.groups[key] = block
+        self.hiddenGroups.discard(key)
+        self.dirty = True
+
+    def hideInstances(self, key):
+        if key in self.groups and key not in self.hiddenGroups:
+            self.hiddenGroups.add(key)
+            self.dirty = True
+
+    def showInstances(self, key):
+        if key in self.hiddenGroups:
+            self.hiddenGroups.discard(key)
+            self.dirty = True
+
+    def removeInstances(self, key):
+        if self.groups.pop(key, None) is not None:
+            self.hiddenGroups.discard(key)
+            self.dirty = True
+
+    def __contains__(self, key):
+        return key in self.groups
+
+    def flush(self):
+        """Upload the visible instances to the GPU if anything changed"""
+        if not self.dirty:
+            return
+        self.dirty = False
+        blocks = [
+            block for key, block in self.groups.items() if key not in self.hiddenGroups
+        ]
+        count = sum(len(block) for block in blocks)
+        if count > self.capacity:
+            capacity = self.capacity
+            while capacity < count:
+                capacity *= 2
+            self._grow(capacity)
+        if count:
+            self.buffer[:count] = np.concatenate(blocks)
+        self.texture.setRamImage(self.buffer.tobytes())
+        self.instanceCount = count
+        # An instance count of 0 turns instancing off rather than drawing nothing
+        if count:
+            self.node.setInstanceCount(count)
+            self.node.show()
+        else:
+            self.node.hide()
+
+
+def _bakedColumns():
+    columns = GeomVertexArrayFormat()
+    columns.addColumn(
+        InternalName.make("instanceCenter"), 3, Geom.NT_float32, Geom.C_other
+    )
+    columns.addColumn(
+        InternalName.make("instanceColor"), 4, Geom.NT_float32, Geom.C_other
+    )
+    columns.addColumn(
+        InternalName.make("instanceFadeDistance"), 1, Geom.NT_float32, Geom.C_other
+    )
+    return columns
+
+
+def _bakedArrays(nodePath):
+    """Yield a writable float view of the baked column array of every geom
+    under `nodePath`, one row per vertex"""
+    for geomNodePath in nodePath.findAllMatches("**/+GeomNode"):
+        geomNode = geomNodePath.node()
+        for i in range(geomNode.getNumGeoms()):
+            vertexData = geomNode.modifyGeom(i).modifyVertexData()
+            index = vertexData.getFormat().getArrayWith("instanceCenter")
+            array = np.asarray(memoryview(vertexData.modifyArray(index)))
+            yield array.view(np.float32).reshape(-1, 8)
+
+
+def makeBakedPrototype(model):
+    """Copy `model` into a detached prototype for flattened chunks, with its
+    color and fadeDistance input moved into per-vertex columns"""
+    color = tuple(model.getColor())
+    fadeDistance = _fadeDistance(model)
+    # Only the geoms are copied: the model's shader inputs would keep every
+    # obstacle in its own state, and its ModelRoot would stop flattenStrong
+    prototype = NodePath("prototype_" + model.getName())
+    for geomNodePath in model.findAllMatches("**/+GeomNode"):
+        geomNodePath.copyTo(prototype).setTransform(geomNodePath.getTransform(model))
+    prototype.setScale(model.getScale())
+    prototype.flattenStrong()
+    for geomNodePath in prototype.findAllMatches("**/+GeomNode"):
+        geomNode = geomNodePath.node()
+        for i in range(geomNode.getNumGeoms()):
+            geom = geomNode.modifyGeom(i)
+            vertexData = geom.getVertexData()
+            vertexFormat = GeomVertexFormat(vertexData.getFormat())
+            vertexFormat.addArray(_bakedColumns())
+            geom.setVertexData(
+                vertexData.convertTo(GeomVertexFormat.registerFormat(vertexFormat))
+            )
+    for array in _bakedArrays(prototype):
+        array[:, 3:7] = color
+        array[:, 7] = fadeDistance
+    return prototype
+
+
+def setBakedCenter(instance, center):
+    """Store the fade center of a copy of a baked prototype; it is kept in
+    the parent's space, which flattening into that parent leaves untouched"""
+    for array in _bakedArrays(instance):
+        array[:, 0:3] = center
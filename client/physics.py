@@ -1,19 +1,162 @@
+import numpy as np
+
+from spatial import packCells
+
+# One entry per body/plane contact: body handle, plane handle, resolved position
+collisionRecord = np.dtype(
+    [("body", np.int64), ("plane", np.int64), ("position", np.float64, 3)]
+)
+
+# Velocity multiplier applied along the plane normal for each collision action
+collisionFactors = {"rebound": -1.0, "damp": -0.5, "stop": 0.0, "magnetic": 1.0}
+
+# Columns of one body's row in a packed state snapshot, after the handle
+_snapshotArrays = (
+    "positions",
+    "rotations",
+    "velocities",
+    "rotationalVelocities",
+    "velocityLimits",
+    "rotationLimits",
+)
+_snapshotWidth = 1 + 3 * len(_snapshotArrays) + 1  # handle, vectors, idleTicks
+_snapshotHeader = 2  # stepCount, bodyCount
+
+# Deepest level of the force field octree, packCells holds 2^20 cells per axis
+_fieldMaxDepth = 20
+
+
+def _runIndices(firsts, counts):
+    """Concatenated ranges firsts[i] .. firsts[i] + counts[i] - 1."""
+    ends = np.cumsum(counts)
+    return np.repeat(firsts - ends + counts, counts) + np.arange(
+        ends[-1] if len(ends) else 0
+    )
+
+
+def wellAcceleration(offsets, strengths, falloffs2):
+    """
+    Pull toward each source: `strength` at the centre, halved at a distance of
+    `falloff`, then dropping off with the inverse square of the distance.
+    `offsets` point from the body to the source along the last axis.
+    """
+    distance2 = np.einsum("...i,...i->...", offsets, offsets)
+    magnitude = strengths * falloffs2 / (distance2 + falloffs2)
+    distance = np.sqrt(distance2)
+    scale = np.divide(
+        magnitude, distance, out=np.zeros_like(distance), where=distance > 0
+    )
+    return offsets * scale[..., None]
+
+
 class physicsMgr:
+    # Packed per-body arrays: name, value a fresh or freed row holds, row shape
+    _bodyArrays = (
+        ("positions", 0.0, (3,)),
+        ("rotations", 0.0, (3,)),
+        ("previousPositions", 0.0, (3,)),
+        ("previousRotations", 0.0, (3,)),
+        ("renderedPositions", 0.0, (3,)),
+        ("renderedRotations", 0.0, (3,)),
+        ("velocities", 0.0, (3,)),
+        ("rotationalVelocities", 0.0, (3,)),
+        ("velocityLimits", np.inf, (3,)),
+        ("rotationLimits", np.inf, (3,)),
+        ("idleTicks", 0, ()),  # consecutive steps spent at rest
+    )
+
     def enable(
         self,
         drag: float = 0.001,
         gravity: tuple = (0, 0, -0.098),
         rotational_drag: float = 0.001,  # Add rotational drag
+        capacity: int = 64,
+        stepHz: float = None,
+        maxSubsteps: int = 5,
+        referenceHz: float = 60,
+        sleepTicks: int = 30,
+        fieldTheta: float = 0.7,
+        fieldDirectLimit: int = 64,
     ):
         self.drag = drag
-        self.gravity = gravity
+        self.gravity = np.array(gravity, dtype=np.float64)
         self.rotational_drag = rotational_drag  # Initialize rotational drag
-        self.registeredObjects = []
+        self.maxSubsteps = maxSubsteps
+        self.referenceHz = referenceHz
+        # Bodies at rest for this many steps drop out of the active set
+        self.sleepTicks = sleepTicks
+        self.setStepRate(stepHz)
+
+        # Body store: one row per registered object, packed into (N, 3) arrays
+        self.bodyCount = 0
+        self.bodyNodes = []
+        self.bodyNames = []
+        self.bodyHandles = []  # row -> handle
+        # Handles stay valid while rows get shuffled around by removals
+        self.nextHandle = 0
+        self.handleRows = {}  # handle -> row
+        self.nameHandles = {}  # name -> handle
+        self.nodeHandles = {}  # NodePath -> handle
+        for attr, fill, shape in self._bodyArrays:
+            setattr(self, attr, np.full((capacity,) + shape, fill))
+
         self.colliders = []
+        self.nextPlaneHandle = 0
+        self._rebuildPlanes()
         self.collisionActions = []
         self.collisions = []
+
+        # Point-source force fields; past fieldDirectLimit sources, they are
+        # kept in an octree and a cell seen under less than fieldTheta (its
+        # size over its distance) acts as one source, Barnes-Hut style
+        self.fieldTheta = fieldTheta
+        self.fieldDirectLimit = fieldDirectLimit
+        self.forceFields = []
+        self.nextFieldHandle = 0
+        self._rebuildFields()
+
+        self.stepCount = 0
+        self.history = None
         self.updating = True
 
+    def setStepRate(self, stepHz: float = None):
+        """
+        Switch to fixed-step simulation at `stepHz`, or back to one step per
+        updateWorldPositions call when `stepHz` is None.
+        Drag, gravity and velocities stay expressed per `referenceHz` tick, so
+        changing the step rate does not change how fast things move.
+        """
+        self.stepHz = stepHz
+        self.stepDt = 1 / stepHz if stepHz else None
+        self.stepScale = self.referenceHz / stepHz if stepHz else 1.0
+        self.accumulator = 0.0
+
+    def _growBodyStore(self):
+        capacity = len(self.velocities) * 2
+        for attr, fill, shape in self._bodyArrays:
+            old = getattr(self, attr)
+            new = np.full((capacity,) + shape, fill)
+            new[: len(old)] = old
+            setattr(self, attr, new)
+
+    @staticmethod
+    def _limitRow(limit):
+        if limit is None:
+            return np.inf
+        if type(limit) == int:
+            limit = [limit for i in range(3)]
+        return np.abs(np.asarray(limit, dtype=np.float64))
+
+    def _row(self, object, name):
+        # `object` may be the handle returned by registerObject (or one read
+        # back from a NumPy array, such as returnCollisions) or the NodePath
+        if isinstance(object, (int, np.integer)):
+            return self.handleRows.get(int(object))
+        handle = self.nodeHandles.get(object)
+        if handle is None:
+            handle = self.nameHandles.get(name)
+        return self.handleRows.get(handle)
+
     def registerObject(
         self,
         object,
@@ -22,17 +165,29 @@ class physicsMgr:
         velocityLimit=None,
         rotational_velocity: list = [0, 0, 0],
         rotationLimit=None,
-    ):
-        self.registeredObjects.append(
-            [
-                object,
-                name,
-                velocity,
-                rotational_velocity,
-                velocityLimit,
-                rotationLimit,
-            ]
-        )  # Add rotational velocity
+    ) -> int:
+        if self.bodyCount == len(self.velocities):
+            self._growBodyStore()
+        row = self.bodyCount
+        handle = self.nextHandle
+        self.nextHandle += 1
+        self.bodyCount += 1
+        self.bodyNodes.append(object)
+        self.bodyNames.append(name)
+        self.bodyHandles.append(handle)
+        self.handleRows[handle] = row
+        self.nameHandles[name] = handle
+        if object is not None:
+            self.nodeHandles[object] = handle
+        self.velocities[row] = velocity
+        self.rotationalVelocities[row] = rotational_velocity
+        self.velocityLimits[row] = self._limitRow(velocityLimit)
+        self.rotationLimits[row] = self._limitRow(rotationLimit)
+        if object is not None:
+            self._readTransforms(np.array([row]))
+            self.previousPositions[row] = self.positions[row]
+            self.previousRotations[row] = self.rotations[row]
+        return handle
 
     def registerColliderPlane(
         self,
@@ -43,7 +198,9 @@ class physicsMgr:
         collisionAction: str = "rebound" or "damp" or "stop" or "magnetic",
         magneticForce: float = 1.0,
         magneticPole: str = "+" or "-",
-    ):
+    ) -> int:
+        handle = self.nextPlaneHandle
+        self.nextPlaneHandle += 1
         self.colliders.append(
             [
                 object,
@@ -53,319 +210,645 @@ class physicsMgr:
                 collisionAction,
                 magneticForce,
                 magneticPole,
+                handle,
             ]
         )
+        self._rebuildPlanes()
+        self._wakeAll()
+        return handle
+
+    def _rebuildPlanes(self):
+        # "+x" keeps bodies above pos on x, "-x" keeps them below it; stored as
+        # axis/sign/offset so a hit is sign * (next - offset) <= 0 for every plane
+        self.planeAxes = np.array(
+            ["xyz".index(collider[3][1]) for collider in self.colliders], dtype=np.intp
+        )
+        self.planeSigns = np.array(
+            [1.0 if collider[3][0] == "+" else -1.0 for collider in self.colliders]
+        )
+        self.planeOffsets = np.array(
+            [collider[2] for collider in self.colliders], dtype=np.float64
+        )
+        self.planeFactors = np.array(
+            [collisionFactors.get(collider[4], 1.0) for collider in self.colliders]
+        )
+        self.planeHandles = np.array(
+            [collider[7] for collider in self.colliders], dtype=np.int64
+        )
+
+    def registerForceField(
+        self,
+        object,
+        name: str,
+        strength: float,
+        falloff: float,
+        position: list = None,
+    ) -> int:
+        """
+        Add a point source that pulls every body toward `object` (or toward
+        `position` if no node is given). `strength` is the acceleration per
+        tick at the centre and `falloff` the distance where it has halved;
+        a negative strength pushes bodies away. Sources are static, the
+        node's position is read once here.
+        """
+        handle = self.nextFieldHandle
+        self.nextFieldHandle += 1
+        if object is not None:
+            position = list(object.getPos())
+        self.forceFields.append([object, name, position, strength, falloff, handle])
+        self._rebuildFields()
+        self._wakeAll()
+        return handle
+
+    def removeForceField(self, object: None, name: str):
+        self.forceFields = [
+            field
+            for field in self.forceFields
+            if not ((object is not None and field[0] == object) or field[1] == name)
+        ]
+        self._rebuildFields()
+        self._wakeAll()
+
+    def _rebuildFields(self):
+        self.fieldPositions = np.array(
+            [field[2] for field in self.forceFields], dtype=np.float64
+        ).reshape(-1, 3)
+        self.fieldStrengths = np.array(
+            [field[3] for field in self.forceFields], dtype=np.float64
+        )
+        self.fieldFalloffs2 = (
+            np.array([field[4] for field in self.forceFields], dtype=np.float64) ** 2
+        )
+        # (cell size, first source, source count, centre, strength, falloff^2,
+        # first child, child count) per octree level, one row per cell
+        self.fieldLevels = []
+        if len(self.forceFields) <= self.fieldDirectLimit:
+            return
+
+        # Octree cells of every source, level by level, until each source has
+        # a cell of its own; level 0 is one cube around all of them
+        positions = self.fieldPositions
+        origin = positions.min(axis=0)
+        rootSize = max((positions.max(axis=0) - origin).max(), 1e-9)
+        levelKeys = []
+        for depth in range(_fieldMaxDepth + 1):
+            side = 1 << depth
+            cells = np.minimum(
+                np.floor((positions - origin) / rootSize * side), side - 1
+            )
+            levelKeys.append(packCells(cells))
+            if len(np.unique(levelKeys[-1])) == len(positions):
+                break
+        # Sorted coarsest level first, every cell owns a contiguous run of
+        # sources and its children split that run
+        order = np.lexsort(levelKeys[::-1])
+        self.fieldOrder = order
+        mass = self.fieldStrengths[order] * self.fieldFalloffs2[order]
+        weight = np.abs(mass)
+        levelStarts = []
+        for keys in levelKeys:
+            keys = keys[order]
+            levelStarts.append(np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]]))
+        for depth, starts in enumerate(levelStarts):
+            counts = np.diff(np.r_[starts, len(order)])
+            centres, strengths, falloffs2 = self._combineSources(
+                order, starts, counts, mass, weight
+            )
+            if depth + 1 < len(levelStarts):
+                childStarts = levelStarts[depth + 1]
+                firstChild = np.searchsorted(childStarts, starts)
+                childCounts = np.searchsorted(childStarts, starts + counts) - firstChild
+            else:
+                firstChild = childCounts = None
+            self.fieldLevels.append(
+                (
+                    rootSize / (1 << depth),
+                    starts,
+                    counts,
+                    centres,
+                    strengths,
+                    falloffs2,
+                    firstChild,
+                    childCounts,
+                )
+            )
+
+    def _combineSources(self, order, starts, counts, mass, weight):
+        """
+        One equivalent source per run of sorted sources: centre of mass,
+        combined strength and mass-weighted falloff. Far from a source only
+        strength * falloff^2 matters, that is the quantity that adds up.
+        """
+        weight = weight.copy()
+        cellWeight = np.add.reduceat(weight, starts)
+        # A cell whose sources all have zero strength places its (zero mass)
+        # source at the plain mean of their positions and falloffs
+        empty = cellWeight == 0
+        if empty.any():
+            weight[np.repeat(empty, counts)] = 1
+            cellWeight[empty] = counts[empty]
+        cellMass = np.add.reduceat(mass, starts)
+        centres = (
+            np.add.reduceat(self.fieldPositions[order] * weight[:, None], starts)
+            / cellWeight[:, None]
+        )
+        falloffs2 = (
+            np.add.reduceat(self.fieldFalloffs2[order] * weight, starts) / cellWeight
+        )
+        strengths = np.divide(
+            cellMass, falloffs2, out=np.zeros_like(cellMass), where=falloffs2 > 0
+        )
+        return centres, strengths, falloffs2
+
+    def fieldAcceleration(self, positions: np.ndarray) -> np.ndarray:
+        """Summed force field acceleration on each of the (N, 3) positions."""
+        if len(self.forceFields) == 0:
+            return np.zeros_like(positions)
+        if len(self.forceFields) <= self.fieldDirectLimit:
+            return wellAcceleration(
+                self.fieldPositions[None, :, :] - positions[:, None, :],
+                self.fieldStrengths,
+                self.fieldFalloffs2,
+            ).sum(axis=1)
+
+        # Walk the octree for every body at once, as (body, cell) pairs at the
+        # current level starting from the root. Accepted pairs are collected
+        # and evaluated together at the end
+        n = len(positions)
+        theta2 = self.fieldTheta**2
+        bodies = np.arange(n)
+        cells = np.zeros(n, dtype=np.int64)
+        pulls = []  # (bodies, offsets, strengths, falloffs2)
+        for (
+            size,
+            starts,
+            counts,
+            centres,
+            strengths,
+            falloffs2,
+            firstChild,
+            childCounts,
+        ) in self.fieldLevels:
+            offsets = centres[cells] - positions[bodies]
+            distance2 = np.einsum("ij,ij->i", offsets, offsets)
+            # A single source is exact, a distant enough cell stands in for
+            # everything under it; the rest are opened
+            accept = (counts[cells] == 1) | (size * size < theta2 * distance2)
+            accepted = cells[accept]
+            pulls.append(
+                (
+                    bodies[accept],
+                    offsets[accept],
+                    strengths[accepted],
+                    falloffs2[accepted],
+                )
+            )
+            opened = ~accept
+            bodies, cells = bodies[opened], cells[opened]
+            if len(bodies) == 0 or firstChild is None:
+                break
+            bodies = np.repeat(bodies, childCounts[cells])
+            cells = _runIndices(firstChild[cells], childCounts[cells])
+
+        # Cells still open at the deepest level hold coincident sources, those
+        # are summed one by one
+        if len(bodies):
+            sourceCounts = counts[cells]
+            sourceBodies = np.repeat(bodies, sourceCounts)
+            sources = self.fieldOrder[_runIndices(starts[cells], sourceCounts)]
+            pulls.append(
+                (
+                    sourceBodies,
+                    self.fieldPositions[sources] - positions[sourceBodies],
+                    self.fieldStrengths[sources],
+                    self.fieldFalloffs2[sources],
+                )
+            )
+        pairBodies, offsets, strengths, falloffs2 = (
+            np.concatenate(column) for column in zip(*pulls)
+        )
+        pulled = wellAcceleration(offsets, strengths, falloffs2)
+        accel = np.empty_like(positions)
+        for axis in range(3):
+            accel[:, axis] = np.bincount(pairBodies, pulled[:, axis], minlength=n)
+        return accel
 
     def registerCollisionAction(self, action, extraArgs: list):
         self.collisionActions.append([action, extraArgs])
 
     def removeObject(self, object: None, name: str):
-        for node in self.registeredObjects:
-            if node[0] == object or node[1] == name:
-                self.registeredObjects.remove(node)
+        row = self._row(object, name)
+        if row is None:
+            return
+        # Move the last body into the freed row so the arrays stay contiguous
+        last = self.bodyCount - 1
+        handle = self.bodyHandles[row]
+        del self.handleRows[handle]
+        if self.nameHandles.get(self.bodyNames[row]) == handle:
+            del self.nameHandles[self.bodyNames[row]]
+        if self.nodeHandles.get(self.bodyNodes[row]) == handle:
+            del self.nodeHandles[self.bodyNodes[row]]
+        if row != last:
+            for attr, fill, shape in self._bodyArrays:
+                getattr(self, attr)[row] = getattr(self, attr)[last]
+            self.bodyNodes[row] = self.bodyNodes[last]
+            self.bodyNames[row] = self.bodyNames[last]
+            self.bodyHandles[row] = self.bodyHandles[last]
+            self.handleRows[self.bodyHandles[row]] = row
+        self.bodyNodes.pop()
+        self.bodyNames.pop()
+        self.bodyHandles.pop()
+        for attr, fill, shape in self._bodyArrays:
+            getattr(self, attr)[last] = fill
+        self.bodyCount -= 1
 
     def removeColliderPlane(self, object: None, name: str):
-        for node in self.colliders:
-            if node[0] == object or node[1] == name:
-                self.colliders.remove(node)
+        self.colliders = [
+            node
+            for node in self.colliders
+            if not ((object is not None and node[0] == object) or node[1] == name)
+        ]
+        self._rebuildPlanes()
+        self._wakeAll()
 
     def setVelocityLimit(self, object: None, name: str, velocityLimit: list):
-        for node in self.registeredObjects:
-            if node[0] == object or node[1] == name:
-                if velocityLimit != None:
-                    if type(velocityLimit) == int:
-                        velocityLimit = [velocityLimit for i in range(3)]
-                    node[4] = velocityLimit
+        row = self._row(object, name)
+        if row is not None and velocityLimit != None:
+            self.velocityLimits[row] = self._limitRow(velocityLimit)
 
     def setRotationLimit(self, object: None, name: str, rotationLimit: list):
-        for node in self.registeredObjects:
-            if node[0] == object or node[1] == name:
-                if rotationLimit != None:
-                    if type(rotationLimit) == int:
-                        rotationLimit = [rotationLimit for i in range(3)]
-                    node[5] = rotationLimit
+        row = self._row(object, name)
+        if row is not None and rotationLimit != None:
+            self.rotationLimits[row] = self._limitRow(rotationLimit)
 
     def addVectorForce(self, object: None, name: str, vector: list):
         if self.updating:
-            for node in self.registeredObjects:
-                if node[0] == object or node[1] == name:
-                    if node[4] != None:
-                        if len(vector) == len(node[2]):
-                            if abs(node[2][0]) < abs(node[4][0]):
-                                node[2][0] += vector[0]
-                            if abs(node[2][1]) < abs(node[4][1]):
-                                node[2][1] += vector[1]
-                            if abs(node[2][2]) < abs(node[4][2]):
-                                node[2][2] += vector[2]
-                        else:
-                            exit(
-                                "Warning: incorrect vector addition for "
-                                + str(node[2])
-                                + " and "
-                                + str(vector)
-                            )
-                    else:
-                        if len(vector) == len(node[2]):
-                            node[2][0] += vector[0]
-                            node[2][1] += vector[1]
-                            node[2][2] += vector[2]
-                        else:
-                            exit(
-                                "Warning: incorrect vector addition for "
-                                + str(node[2])
-                                + " and "
-                                + str(vector)
-                            )
+            row = self._row(object, name)
+            if row is None:
+                return
+            if len(vector) != 3:
+                exit(
+                    "Warning: incorrect vector addition for "
+                    + str(list(self.velocities[row]))
+                    + " and "
+                    + str(vector)
+                )
+            velocity = self.velocities[row]
+            below = np.abs(velocity) < self.velocityLimits[row]
+            velocity[below] += np.asarray(vector, dtype=np.float64)[below]
+            self.idleTicks[row] = 0
 
     def addRotationalForce(self, object: None, name: str, rotational_vector: list):
         if self.updating:
-            for node in self.registeredObjects:
-                if node[0] == object or node[1] == name:
-                    if node[5] != None:
-                        if len(rotational_vector) == len(node[3]):
-                            if abs(node[3][0]) < abs(node[5][0]):
-                                node[3][0] += rotational_vector[0]
-                            if abs(node[3][1]) < abs(node[5][1]):
-                                node[3][1] += rotational_vector[1]
-                            if abs(node[3][2]) < abs(node[5][2]):
-                                node[3][2] += rotational_vector[2]
-                        else:
-                            exit(
-                                "Warning: incorrect rotational vector addition for "
-                                + str(node[3])
-                                + " and "
-                                + str(rotational_vector)
-                            )
-                    else:
-                        if len(rotational_vector) == len(node[3]):
-                            node[3][0] += rotational_vector[0]
-                            node[3][1] += rotational_vector[1]
-                            node[3][2] += rotational_vector[2]
-                        else:
-                            exit(
-                                "Warning: incorrect rotational vector addition for "
-                                + str(node[3])
-                                + " and "
-                                + str(rotational_vector)
-                            )
+            row = self._row(object, name)
+            if row is None:
+                return
+            if len(rotational_vector) != 3:
+                exit(
+                    "Warning: incorrect rotational vector addition for "
+                    + str(list(self.rotationalVelocities[row]))
+                    + " and "
+                    + str(rotational_vector)
+                )
+            velocity = self.rotationalVelocities[row]
+            below = np.abs(velocity) < self.rotationLimits[row]
+            velocity[below] += np.asarray(rotational_vector, dtype=np.float64)[below]
+            self.idleTicks[row] = 0
 
     def clearVectorForce(self, object: None, name: str):
         if self.updating:
-            for node in self.registeredObjects:
-                if node[0] == object or node[1] == name:
-                    node[2] = [0, 0, 0]
+            row = self._row(object, name)
+            if row is not None:
+                self.velocities[row] = 0
 
     def clearRotationalForce(self, object: None, name: str):
         if self.updating:
-            for node in self.registeredObjects:
-                if node[0] == object or node[1] == name:
-                    node[3] = [0, 0, 0]
-    
+            row = self._row(object, name)
+            if row is not None:
+                self.rotationalVelocities[row] = 0
+
     def setObjectVelocity(self, object, name, velocity: list):
-        for node in self.registeredObjects:
-            if node[0] == object or node[1] == name:
-                if len(velocity) == 3:
-                    node[2] = velocity
-                else:
-                    exit(
-                        "Warning: incorrect velocity vector for "
-                        + str(node[2])
-                        + " and "
-                        + str(velocity)
-                    )
+        row = self._row(object, name)
+        if row is None:
+            return
+        if len(velocity) == 3:
+            self.velocities[row] = velocity
+            self.idleTicks[row] = 0
+        else:
+            exit(
+                "Warning: incorrect velocity vector for "
+                + str(list(self.velocities[row]))
+                + " and "
+                + str(velocity)
+            )
+
+    def wakeObject(self, object, name):
+        row = self._row(object, name)
+        if row is not None:
+            self.idleTicks[row] = 0
+
+    def isSleeping(self, object, name) -> bool:
+        row = self._row(object, name)
+        return row is not None and bool(self.idleTicks[row] >= self.sleepTicks)
+
+    def _wakeAll(self):
+        self.idleTicks[: self.bodyCount] = 0
 
     def getObjectVelocity(self, object, name) -> list[3]:
-        for node in self.registeredObjects:
-            if node[0] == object or node[1] == name:
-                return node[2]
+        row = self._row(object, name)
+        if row is not None:
+            return self.velocities[row].tolist()
 
     def getObjectRotationalVelocity(self, object, name) -> list[3]:
-        for node in self.registeredObjects:
-            if node[0] == object or node[1] == name:
-                return node[3]
+        row = self._row(object, name)
+        if row is not None:
+            return self.rotationalVelocities[row].tolist()
 
-    def returnCollisions(self) -> list:
-        return self.collisions
+    def returnCollisions(self) -> np.ndarray:
+        """
+        All collisions since the last clearCollisions, as a `collisionRecord`
+        array of (body handle, plane handle, position).
+        """
+        if not self.collisions:
+            return np.empty(0, dtype=collisionRecord)
+        if len(self.collisions) > 1:
+            self.collisions = [np.concatenate(self.collisions)]
+        return self.collisions[0]
 
     def clearCollisions(self):
         self.collisions = []
 
     def runCollisionActions(self):
         for actionList in self.collisionActions:
-            actionList[0](val for val in actionList[1])
+            actionList[0](*actionList[1])
+
+    def _readTransforms(self, rows):
+        # One getPos/getHpr per body, then a single bulk copy into the arrays
+        nodes = self.bodyNodes
+        transforms = np.array(
+            [(*nodes[row].getPos(), *nodes[row].getHpr()) for row in rows]
+        ).reshape(-1, 6)
+        self.positions[rows] = transforms[:, :3]
+        self.rotations[rows] = transforms[:, 3:]
+        self.renderedPositions[rows] = transforms[:, :3]
+        self.renderedRotations[rows] = transforms[:, 3:]
+
+    def _syncTransforms(self, rows):
+        # The physics arrays own the pose; only adopt the scene graph's value
+        # when something else moved the node since we last wrote it
+        nodes = self.bodyNodes
+        transforms = np.array(
+            [(*nodes[row].getPos(), *nodes[row].getHpr()) for row in rows]
+        ).reshape(-1, 6)
+        written = np.hstack(
+            (self.renderedPositions[rows], self.renderedRotations[rows])
+        )
+        moved = ~np.all(np.isclose(transforms, written, rtol=1e-5, atol=1e-4), axis=1)
+        if np.any(moved):
+            rows = rows[moved]
+            transforms = transforms[moved]
+            for attr in ("positions", "previousPositions", "renderedPositions"):
+                getattr(self, attr)[rows] = transforms[:, :3]
+            for attr in ("rotations", "previousRotations", "renderedRotations"):
+                getattr(self, attr)[rows] = transforms[:, 3:]
+
+    def _writeTransforms(self, rows, alpha: float = 1.0):
+        # Blend between the last two physics states and only touch nodes whose
+        # rendered pose actually changes
+        previous = self.previousPositions[rows]
+        positions = previous + alpha * (self.positions[rows] - previous)
+        previous = self.previousRotations[rows]
+        rotations = previous + alpha * (self.rotations[rows] - previous)
+        changed = np.any(positions != self.renderedPositions[rows], axis=1) | np.any(
+            rotations != self.renderedRotations[rows], axis=1
+        )
+        if not changed.any():
+            return
+        rows = rows[changed]
+        positions = positions[changed]
+        rotations = rotations[changed]
+        self.renderedPositions[rows] = positions
+        self.renderedRotations[rows] = rotations
+        nodes = self.bodyNodes
+        transforms = np.hstack((positions, rotations)).tolist()
+        for row, transform in zip(rows.tolist(), transforms):
+            nodes[row].setPosHpr(*transform)
+
+    @staticmethod
+    def _applyDrag(velocities, drag):
+        # Pull every component toward zero by `drag`, snapping to zero once inside it
+        return np.where(
+            np.abs(velocities) > drag, velocities - np.sign(velocities) * drag, 0.0
+        )
+
+    def _activeRows(self):
+        return np.flatnonzero(self.idleTicks[: self.bodyCount] < self.sleepTicks)
+
+    def _step(self):
+        self.stepCount += 1
+        active = self._activeRows()
+        if len(active) == 0:
+            return
+        scale = self.stepScale
+        self.previousPositions[active] = self.positions[active]
+        self.previousRotations[active] = self.rotations[active]
+
+        # drag, gravity and rotational drag for every awake body at once
+
+        velocities = (
+            self._applyDrag(self.velocities[active], self.drag * scale)
+            + self.gravity * scale
+        )
+        if self.forceFields:
+            velocities += self.fieldAcceleration(self.positions[active]) * scale
+        rotationalVelocities = self._applyDrag(
+            self.rotationalVelocities[active], self.rotational_drag * scale
+        )
+
+        # clamp to the per-body limits (inf where no limit was given)
+
+        limits = self.velocityLimits[active]
+        np.clip(velocities, -limits, limits, out=velocities)
+        limits = self.rotationLimits[active]
+        np.clip(rotationalVelocities, -limits, limits, out=rotationalVelocities)
+        self.velocities[active] = velocities
+        self.rotationalVelocities[active] = rotationalVelocities
+
+        moving = np.any(velocities != 0, axis=1) | np.any(
+            rotationalVelocities != 0, axis=1
+        )
+        self.idleTicks[active] = np.where(moving, 0, self.idleTicks[active] + 1)
+        rows = active[moving]
+        if len(rows) == 0:
+            return
+
+        # collision math
+
+        if len(self.planeAxes):
+            self._resolvePlanes(rows)
+
+        # integrate
+
+        self.positions[rows] += self.velocities[rows] * scale
+        self.rotations[rows] += self.rotationalVelocities[rows] * scale
+
+    def _resolvePlanes(self, rows):
+        # Test every moving body against every plane in one (bodies, planes) pass
+        scale = self.stepScale
+        velocities = self.velocities[rows]
+        positions = self.positions[rows]
+        axes = self.planeAxes
+        nextPos = positions[:, axes] + velocities[:, axes] * scale
+        hits = self.planeSigns * (nextPos - self.planeOffsets) <= 0
+        if not hits.any():
+            return
 
-    def updateWorldPositions(self):
+        # planes sharing an axis compound, e.g. two rebounds cancel out
+        factors = np.where(hits, self.planeFactors, 1.0)
+        for axis in range(3):
+            onAxis = axes == axis
+            if onAxis.any():
+                velocities[:, axis] *= factors[:, onAxis].prod(axis=1)
+        self.velocities[rows] = velocities
+
+        bodyIdx, planeIdx = np.nonzero(hits)
+        record = np.empty(len(bodyIdx), dtype=collisionRecord)
+        record["body"] = np.asarray(self.bodyHandles)[rows[bodyIdx]]
+        record["plane"] = self.planeHandles[planeIdx]
+        record["position"] = positions[bodyIdx] + velocities[bodyIdx] * scale
+        self.collisions.append(record)
+        self.idleTicks[rows[bodyIdx]] = 0
+        self.runCollisionActions()
+
+    def updateWorldPositions(self, dt: float = None):
+        """
+        Advance the simulation and push the result to the scene graph.
+        With a step rate set, `dt` is the frame time in seconds: it is run as
+        whole fixed steps (at most `maxSubsteps` per call) and the leftover
+        fraction interpolates the rendered transforms between the last two
+        steps. Without a step rate, or without `dt`, one step runs per call.
+        """
         if self.updating:
-            for node in self.registeredObjects:
-
-                # drag
-
-                for i in range(len(node[2])):
-                    if abs(node[2][i]) > self.drag:
-                        if node[2][i] > 0:
-                            node[2][i] -= self.drag
-                        if node[2][i] < 0:
-                            node[2][i] += self.drag
-                    else:
-                        node[2][i] = 0
-
-                # gravity
-
-                for i in range(len(node[2])):
-                    node[2][i] += self.gravity[i]
-
-                # rotational drag
-                for i in range(len(node[3])):
-                    if abs(node[3][i]) > self.rotational_drag:
-                        if node[3][i] > 0:
-                            node[3][i] -= self.rotational_drag
-                        if node[3][i] < 0:
-                            node[3][i] += self.rotational_drag
-                    else:
-                        node[3][i] = 0
-
-                # final check, collisions + updated pos
-
-                if len(self.colliders) == 0:
-                    node[0].setPos(
-                        node[0].getPos()[0] + node[2][0],
-                        node[0].getPos()[1] + node[2][1],
-                        node[0].getPos()[2] + node[2][2],
-                    )
-                    node[0].setHpr(
-                        node[0].getH() + node[3][0],
-                        node[0].getP() + node[3][1],
-                        node[0].getR() + node[3][2],
-                    )
-                else:
-
-                    # collision math
-
-                    for collider in self.colliders:
-                        if collider[3] == "+x":
-                            if node[0].getPos()[0] + node[2][0] <= collider[2]:
-                                if collider[4] == "rebound":
-                                    node[2][0] = -(node[2][0])
-                                if collider[4] == "damp":
-                                    node[2][0] = -(0.5 * node[2][0])
-                                if collider[4] == "stop":
-                                    node[2][0] = 0
-                                self.collisions.append(
-                                    [
-                                        node,
-                                        (
-                                            node[0].getPos()[0] + node[2][0],
-                                            node[0].getPos()[1] + node[2][1],
-                                            node[0].getPos()[2] + node[2][2],
-                                        ),
-                                    ]
-                                )
-                                self.runCollisionActions(self=self)
-                        if collider[3] == "-x":
-                            if node[0].getPos()[0] + node[2][0] >= collider[2]:
-                                if collider[4] == "rebound":
-                                    node[2][0] = -(node[2][0])
-                                if collider[4] == "damp":
-                                    node[2][0] = -(0.5 * node[2][0])
-                                if collider[4] == "stop":
-                                    node[2][0] = 0
-                                self.collisions.append(
-                                    [
-                                        node,
-                                        (
-                                            node[0].getPos()[0] + node[2][0],
-                                            node[0].getPos()[1] + node[2][1],
-                                            node[0].getPos()[2] + node[2][2],
-                                        ),
-                                    ]
-                                )
-                                self.runCollisionActions(self=self)
-                        if collider[3] == "+y":
-                            if node[0].getPos()[1] + node[2][1] <= collider[2]:
-                                if collider[4] == "rebound":
-                                    node[2][1] = -(node[2][1])
-                                if collider[4] == "damp":
-                                    node[2][1] = -(0.5 * node[2][1])
-                                if collider[4] == "stop":
-                                    node[2][1] = 0
-                                self.collisions.append(
-                                    [
-                                        node,
-                                        (
-                                            node[0].getPos()[0] + node[2][0],
-                                            node[0].getPos()[1] + node[2][1],
-                                            node[0].getPos()[2] + node[2][2],
-                                        ),
-                                    ]
-                                )
-                                self.runCollisionActions(self=self)
-                        if collider[3] == "-y":
-                            if node[0].getPos()[1] + node[2][1] >= collider[2]:
-                                if collider[4] == "rebound":
-                                    node[2][1] = -(node[2][1])
-                                if collider[4] == "damp":
-                                    node[2][1] = -(0.5 * node[2][1])
-                                if collider[4] == "stop":
-                                    node[2][1] = 0
-                                self.collisions.append(
-                                    [
-                                        node,
-                                        (
-                                            node[0].getPos()[0] + node[2][0],
-                                            node[0].getPos()[1] + node[2][1],
-                                            node[0].getPos()[2] + node[2][2],
-                                        ),
-                                    ]
-                                )
-                                self.runCollisionActions(self=self)
-                        if collider[3] == "+z":
-                            if node[0].getPos()[2] + node[2][2] <= collider[2]:
-                                if collider[4] == "rebound":
-                                    node[2][2] = -(node[2][2])
-                                if collider[4] == "damp":
-                                    node[2][2] = -(0.5 * node[2][2])
-                                if collider[4] == "stop":
-                                    node[2][2] = 0
-                                self.collisions.append(
-                                    [
-                                        node,
-                                        (
-                                            node[0].getPos()[0] + node[2][0],
-                                            node[0].getPos()[1] + node[2][1],
-                                            node[0].getPos()[2] + node[2][2],
-                                        ),
-                                    ]
-                                )
-                                self.runCollisionActions(self=self)
-                        if collider[3] == "-z":
-                            if node[0].getPos()[2] + node[2][2] >= collider[2]:
-                                if collider[4] == "rebound":
-                                    node[2][2] = -(node[2][2])
-                                if collider[4] == "damp":
-                                    node[2][2] = -(0.5 * node[2][2])
-                                if collider[4] == "stop":
-                                    node[2][2] = 0
-                                self.collisions.append(
-                                    [
-                                        node,
-                                        (
-                                            node[0].getPos()[0] + node[2][0],
-                                            node[0].getPos()[1] + node[2][1],
-                                            node[0].getPos()[2] + node[2][2],
-                                        ),
-                                    ]
-                                )
-                                self.runCollisionActions(self=self)
-
-                    # update FINAL position
-
-                    node[0].setPos(
-                        node[0].getPos()[0] + node[2][0],
-                        node[0].getPos()[1] + node[2][1],
-                        node[0].getPos()[2] + node[2][2],
-                    )
-                    node[0].setHpr(
-                        node[0].getH() + node[3][0],
-                        node[0].getP() + node[3][1],
-                        node[0].getR() + node[3][2],
-                    )
+            n = self.bodyCount
+            if n == 0:
+                return
+
+            # pick up nodes that were moved outside of the physics manager
+
+            active = self._activeRows()
+            rows = active[
+                np.any(self.velocities[active] != 0, axis=1)
+                | np.any(self.rotationalVelocities[active] != 0, axis=1)
+            ]
+            if len(rows):
+                self._syncTransforms(rows)
+
+            if self.stepDt is None or dt is None:
+                self._step()
+                self._recordHistory()
+                self._writeTransforms(active)
+                return
+
+            self.accumulator += dt
+            steps = min(int(self.accumulator / self.stepDt), self.maxSubsteps)
+            self.accumulator -= steps * self.stepDt
+            if self.accumulator >= self.stepDt:
+                # fell behind by more than maxSubsteps, drop the backlog
+                self.accumulator %= self.stepDt
+            for _ in range(steps):
+                self._step()
+                self._recordHistory()
+            self._writeTransforms(active, self.accumulator / self.stepDt)
+
+    # snapshots
+
+    def snapshotSize(self) -> int:
+        """Number of float64 values a snapshot of the current bodies takes."""
+        return _snapshotHeader + self.bodyCount * _snapshotWidth
+
+    def _packState(self, out: np.ndarray) -> np.ndarray:
+        n = self.bodyCount
+        out[0] = self.stepCount
+        out[1] = n
+        rows = out[_snapshotHeader : _snapshotHeader + n * _snapshotWidth].reshape(
+            n, _snapshotWidth
+        )
+        rows[:, 0] = self.bodyHandles
+        for i, attr in enumerate(_snapshotArrays):
+            rows[:, 1 + 3 * i : 4 + 3 * i] = getattr(self, attr)[:n]
+        rows[:, -1] = self.idleTicks[:n]
+        return out[: _snapshotHeader + n * _snapshotWidth]
+
+    def snapshot(self) -> bytes:
+        """
+        Pack every body's pose, velocities, limits and sleep state, plus the
+        step counter, into one float64 buffer that restore() accepts.
+        """
+        return self._packState(np.empty(self.snapshotSize())).tobytes()
+
+    def restore(self, buffer):
+        """
+        Put bodies back to the state held in a snapshot() buffer or history
+        slot. Bodies removed since are skipped, bodies added since are left
+        as they are.
+        """
+        state = np.frombuffer(buffer, dtype=np.float64)
+        count = int(state[1])
+        rows = state[_snapshotHeader : _snapshotHeader + count * _snapshotWidth]
+        rows = rows.reshape(count, _snapshotWidth)
+        handles = rows[:, 0].astype(np.int64).tolist()
+        targets = [self.handleRows.get(handle, -1) for handle in handles]
+        targets = np.array(targets, dtype=np.intp).reshape(-1)
+        keep = targets >= 0
+        rows = rows[keep]
+        targets = targets[keep]
+        for i, attr in enumerate(_snapshotArrays):
+            getattr(self, attr)[targets] = rows[:, 1 + 3 * i : 4 + 3 * i]
+        self.idleTicks[targets] = rows[:, -1]
+        self.previousPositions[targets] = self.positions[targets]
+        self.previousRotations[targets] = self.rotations[targets]
+        self.stepCount = int(state[0])
+        self.accumulator = 0.0
+        self._writeTransforms(targets)
+
+    def enableHistory(self, seconds: float = 10):
+        """
+        Keep a ring buffer with a snapshot of every step for the last
+        `seconds`, for rewind(). Slots are preallocated and overwritten in
+        place, so recording does not allocate per step.
+        """
+        slots = int(np.ceil(seconds * (self.stepHz or self.referenceHz)))
+        self.history = np.zeros((slots, self.snapshotSize()))
+        self.historyHead = 0  # slot the next snapshot goes into
+        self.historyCount = 0
+
+    def disableHistory(self):
+        self.history = None
+
+    def _recordHistory(self):
+        if self.history is None:
+            return
+        if self.snapshotSize() > self.history.shape[1]:
+            # more bodies than the slots were sized for, widen them
+            wider = np.zeros((len(self.history), self.snapshotSize() * 2))
+            wider[:, : self.history.shape[1]] = self.history
+            self.history = wider
+        self._packState(self.history[self.historyHead])
+        self.historyHead = (self.historyHead + 1) % len(self.history)
+        self.historyCount = min(self.historyCount + 1, len(self.history))
+
+    def rewind(self, seconds: float) -> bool:
+        """
+        Restore the recorded step `seconds` ago (clamped to the oldest one
+        kept) and drop the history after it. Returns False when nothing has
+        been recorded.
+        """
+        if self.history is None or self.historyCount == 0:
+            return False
+        back = int(round(seconds * (self.stepHz or self.referenceHz)))
+        back = min(max(back, 0), self.historyCount - 1)
+        slot = (self.historyHead - 1 - back) % len(self.history)
+        self.restore(self.history[slot])
+        self.historyHead = (slot + 1) % len(self.history)
+        self.historyCount -= back
+        return True
@@ -0,0 +1,96 @@
+"""
+Headless throughput benchmark for physicsMgr.
+
+Drives the physics manager with bare NodePaths (no window or ShowBase) and
+reports steps per second and the cost per body for a grid of body and
+collider plane counts:
+
+    python client/physicsBenchmark.py
+    python client/physicsBenchmark.py --bodies 1000 --planes 6 --seconds 2
+"""
+
+import argparse
+from time import perf_counter
+
+import numpy as np
+from panda3d.core import NodePath
+
+from physics import physicsMgr
+
+BODY_COUNTS = [1, 100, 1000, 10000]
+PLANE_COUNTS = [0, 6, 50]
+ARENA_SIZE = 1000
+
+
+def build_scene(body_count, plane_count, seed=0):
+    rng = np.random.default_rng(seed)
+    mgr = physicsMgr()
+    mgr.enable(drag=0, gravity=(0, 0, 0), capacity=max(body_count, 1))
+    root = NodePath("benchmarkRoot")
+    positions = rng.uniform(-ARENA_SIZE / 2, ARENA_SIZE / 2, (body_count, 3))
+    velocities = rng.uniform(-1, 1, (body_count, 3))
+    for i in range(body_count):
+        node = root.attachNewNode("body" + str(i))
+        node.setPos(*positions[i])
+        mgr.registerObject(
+            object=node,
+            name="body" + str(i),
+            velocity=velocities[i].tolist(),
+            rotational_velocity=[1, 0, 0],
+        )
+
+    # The first six planes box the arena in, the rest are scattered inside it
+    orientations = ["+x", "-x", "+y", "-y", "+z", "-z"]
+    for i in range(plane_count):
+        orientation = orientations[i % 6]
+        if i < 6:
+            pos = ARENA_SIZE if orientation[0] == "-" else -ARENA_SIZE
+        else:
+            pos = rng.uniform(-ARENA_SIZE, ARENA_SIZE)
+        mgr.registerColliderPlane(
+            object=None,
+            pos=pos,
+            name="plane" + str(i),
+            orientation=orientation,
+            collisionAction="rebound",
+        )
+    return mgr
+
+
+def run_case(body_count, plane_count, seconds=1.0):
+    mgr = build_scene(body_count, plane_count)
+    mgr.updateWorldPositions()  # warm up
+    steps = 0
+    start = perf_counter()
+    elapsed = 0.0
+    while elapsed < seconds:
+        mgr.updateWorldPositions()
+        mgr.clearCollisions()
+        steps += 1
+        elapsed = perf_counter() - start
+    steps_per_sec = steps / elapsed
+    us_per_body = elapsed / steps / body_count * 1e6
+    return steps_per_sec, us_per_body
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--bodies", type=int, nargs="*", default=BODY_COUNTS)
+    parser.add_argument("--planes", type=int, nargs="*", default=PLANE_COUNTS)
+    parser.add_argument(
+        "--seconds", type=float, default=1.0, help="time spent on each case"
+    )
+    args = parser.parse_args()
+
+    print(f"{'bodies':>8} {'planes':>7} {'steps/s':>11} {'us/body':>9}")
+    for body_count in args.bodies:
+        for plane_count in args.planes:
+            steps_per_sec, us_per_body = run_case(body_count, plane_count, args.seconds)
+            print(
+                f"{body_count:>8} {plane_count:>7} "
+                f"{steps_per_sec:>11.1f} {us_per_body:>9.3f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
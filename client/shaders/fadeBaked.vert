@@ -0,0 +1,22 @@
+#version 330
+
+uniform mat4 p3d_ModelViewProjectionMatrix;
+uniform mat4 p3d_ModelMatrix;
+
+in vec4 p3d_Vertex;
+in vec3 instanceCenter;
+in vec4 instanceColor;
+in float instanceFadeDistance;
+
+out vec3 worldPos;
+flat out vec3 fadeCenter;
+flat out float fadeDistance;
+flat out vec4 fadeColor;
+
+void main() {
+    worldPos = (p3d_ModelMatrix * p3d_Vertex).xyz;
+    fadeCenter = (p3d_ModelMatrix * vec4(instanceCenter, 1.0)).xyz;
+    fadeDistance = instanceFadeDistance;
+    fadeColor = instanceColor;
+    gl_Position = p3d_ModelViewProjectionMatrix * p3d_Vertex;
+}
@@ -0,0 +1,14 @@
+#version 330
+
+flat in vec3 fadeCenter;
+flat in float fadeDistance;
+flat in vec4 fadeColor;
+in vec3 worldPos;
+
+out vec4 fragColor;
+
+void main(){
+    float distance=length(worldPos.xy-fadeCenter.xy);// Use 2D distance for grid fading
+    float alpha=clamp(1.-(distance/fadeDistance),0.,1.);
+    fragColor=vec4(fadeColor.rgb,fadeColor.a*alpha);
+}
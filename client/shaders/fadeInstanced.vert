@@ -0,0 +1,25 @@
+#version 330
+
+uniform mat4 p3d_ModelViewProjectionMatrix;
+uniform mat4 p3d_ModelMatrix;
+uniform samplerBuffer instanceData;
+
+in vec4 p3d_Vertex;
+
+out vec3 worldPos;
+flat out vec3 fadeCenter;
+flat out float fadeDistance;
+flat out vec4 fadeColor;
+
+void main() {
+    // Three texels per instance: (x, y, z, scale), fade color, fade distance
+    int base = gl_InstanceID * 3;
+    vec4 placement = texelFetch(instanceData, base);
+    fadeColor = texelFetch(instanceData, base + 1);
+    fadeDistance = texelFetch(instanceData, base + 2).x;
+
+    vec4 vertex = vec4(p3d_Vertex.xyz * placement.w + placement.xyz, 1.0);
+    worldPos = (p3d_ModelMatrix * vertex).xyz;
+    fadeCenter = (p3d_ModelMatrix * vec4(placement.xyz, 1.0)).xyz;
+    gl_Position = p3d_ModelViewProjectionMatrix * vertex;
+}
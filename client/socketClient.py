@@ -4,18 +4,92 @@ import socket
 import subprocess
 import re
 import direct.stdpy.threading as threading
-import json
-
-outbound = []
+from collections import deque
+import os
+import sys
+
+# The wire protocol lives once, in the top-level shared/ folder
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "shared")
+)
+from wireProtocol import MSG, STATE_TYPES, decode, drop_superseded, encode, pack_frames
+
+outbound = deque()  # records, or (type,) placeholders for STATE_TYPES
+latest = {}  # message type -> newest unsent record of that type
 incoming = []
+# Messages and bytes queued but not yet handed to the socket
+backlog = {"messages": 0, "bytes": 0, "peak_bytes": 0}
+BACKLOG_WARN_BYTES = 4 * 1024 * 1024
+_backlog_lock = threading.Lock()
+_backlog_warned = False
+_loop = None  # event loop of the connection, set by _connect_to_server
+_wakeup = None  # asyncio.Event the sender sleeps on
 
 
-def send_message(message):
+def send_message(msgType, payload=None):
+    """
+    Queue a message for the server. STATE_TYPES are latest-value state: one
+    still waiting to be sent is replaced by the next of the same type,
+    keeping its place in the queue.
+    """
+    global _backlog_warned
     try:
-        message = json.dumps(message)
+        message = encode(msgType, payload)
     except Exception as e:
-        raise ValueError("Message must be a JSON encodable object") from e
-    outbound.append(message)
+        raise ValueError(f"Payload does not fit the {msgType!r} layout") from e
+    key = msgType if msgType in STATE_TYPES else None
+    with _backlog_lock:
+        if key is None:
+            outbound.append(message)
+        else:
+            replaced = latest.get(key)
+            if replaced is None:
+                outbound.append((key,))
+            else:
+                backlog["messages"] -= 1
+                backlog["bytes"] -= len(replaced)
+            latest[key] = message
+        backlog["messages"] += 1
+        backlog["bytes"] += len(message)
+        backlog["peak_bytes"] = max(backlog["peak_bytes"], backlog["bytes"])
+        warn = backlog["bytes"] > BACKLOG_WARN_BYTES and not _backlog_warned
+        if warn:
+            _backlog_warned = True
+    if warn:
+        print(
+            f"CLIENT: Outbound backlog at {backlog['bytes'] // 1024} KiB "
+            f"({backlog['messages']} messages), the server is not keeping up"
+        )
+    if _loop is not None:
+        try:
+            _loop.call_soon_threadsafe(_wakeup.set)
+        except RuntimeError:
+            pass  # connection loop already closed
+
+
+def get_backlog():
+    """(messages, bytes) queued for the server but not yet sent."""
+    with _backlog_lock:
+        return backlog["messages"], backlog["bytes"]
+
+
+def _take_outbound():
+    """Every record queued so far, in queue order."""
+    with _backlog_lock:
+        batch = []
+        while outbound:
+            item = outbound.popleft()
+            batch.append(latest.pop(item[0]) if isinstance(item, tuple) else item)
+        return batch
+
+
+def _sent(batch):
+    global _backlog_warned
+    with _backlog_lock:
+        backlog["messages"] -= len(batch)
+        backlog["bytes"] -= sum(len(message) for message in batch)
+        if backlog["bytes"] <= BACKLOG_WARN_BYTES // 2:
+            _backlog_warned = False
 
 
 def iter_messages():
@@ -23,7 +97,7 @@ def iter_messages():
     incoming.clear()
     if not val:
         return []
-    return [json.loads(id) for id in val]
+    return drop_superseded([message for frame in val for message in decode(frame)])
 
 
 disconnect_callback = lambda: None
@@ -46,6 +120,9 @@ def register_disconnect_callback(callback):
 
 def _connect_to_server(uri):
     async def connect():
+        global _loop, _wakeup
+        _wakeup = asyncio.Event()
+        _loop = asyncio.get_running_loop()
         async with ws.connect(uri) as websocket:
             print(f"CLIENT: Connected to server at {uri}")
 
@@ -65,13 +142,17 @@ def _connect_to_server(uri):
 
             async def send_outbound():
                 await websocket.send("WS_CLIENT_REGISTER")
+                _wakeup.set()  # anything queued before the connection
                 while True:
                     try:
-                        if outbound:
-                            message = outbound.pop(0)
-                            await websocket.send(message)
-                        else:
-                            await asyncio.sleep(1 / 60)  # <-- Add this line
+                        # Sleep until send_message wakes us, then send everything
+                        await _wakeup.wait()
+                        _wakeup.clear()
+                        while outbound:
+                            batch = _take_outbound()
+                            for frame in pack_frames(batch):
+                                await websocket.send(frame)
+                            _sent(batch)
                     except ws.ConnectionClosed:
                         print("CLIENT: Connection closed while sending")
                         disconnect_callback()
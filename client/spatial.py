@@ -0,0 +1,42 @@
+import numpy as np
+
+
+def packCells(cells: np.ndarray) -> np.ndarray:
+    """
+    Pack (N, 3) integer cell coordinates into one int64 key per cell, 21 bits
+    per axis, so cell lookups become sorted-array searches.
+    """
+    cells = cells.astype(np.int64) + (1 << 20)
+    return (cells[:, 0] << 42) | (cells[:, 1] << 21) | cells[:, 2]
+
+
+class CellIndex:
+    """
+    Set of integer (x, y, z) cells kept as a sorted array of packed keys, so
+    membership tests, inserts and removals are one NumPy call per batch.
+    """
+
+    def __init__(self):
+        self.keys = np.empty(0, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def contains(self, cells):
+        """Boolean mask of which rows of `cells` are in the index"""
+        keys = packCells(np.asarray(cells).reshape(-1, 3))
+        if len(self.keys) == 0:
+            return np.zeros(len(keys), dtype=bool)
+        found = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+        return self.keys[found] == keys
+
+    def add(self, cells):
+        keys = packCells(np.asarray(cells).reshape(-1, 3))
+        self.keys = np.union1d(self.keys, keys)
+
+    def discard(self, cells):
+        keys = packCells(np.asarray(cells).reshape(-1, 3))
+        self.keys = np.setdiff1d(self.keys, keys, assume_unique=False)
+
+    def clear(self):
+        self.keys = np.empty(0, dtype=np.int64)
@@ -0,0 +1,101 @@
+"""
+Headless check that WorldManager keeps the obstacles around the ship loaded.
+
+Flies a bare NodePath across the world the way clientApp streams terrain and,
+after every step, makes sure each obstacle within --radius world units of the
+ship belongs to a loaded chunk:
+
+    python client/terrainCheck.py
+    python client/terrainCheck.py --distance 5000 --radius 300
+"""
+
+import argparse
+import math
+import sys
+
+import numpy as np
+from panda3d.core import NodePath
+
+from worldgen import (
+    CLIENT_WORLD,
+    OBSTACLE_SPACING,
+    WorldGen,
+    WorldManager,
+    place_obstacles,
+)
+
+HEADINGS = [0, 45, 90, 180, 250]  # degrees, 0 flies along +x
+RENDER_DISTANCE = 3
+
+
+def fly(heading, distance, step, radius, seed=0):
+    """Fly from the origin along `heading`; the first miss, or None."""
+    worldGen = WorldGen(**CLIENT_WORLD, seed=seed, tile_dir=None)
+    ship = NodePath("ship")
+    manager = WorldManager(
+        WorldGen=worldGen,
+        renderObject=ship,
+        renderDistance=RENDER_DISTANCE,
+        scale_multiplier=1 / (OBSTACLE_SPACING * worldGen.VOX_SC),
+        workers=0,
+    )
+    chunkWorldSize = worldGen.CHUNK_SIZE * OBSTACLE_SPACING
+    reach = math.ceil(radius / chunkWorldSize) + 2
+    loaded = set()
+    placed = {}  # (x, y) -> obstacle positions, generated once for the check
+    dx, dy = math.cos(math.radians(heading)), math.sin(math.radians(heading))
+    for travelled in np.arange(0, distance, step):
+        ship.setPos(travelled * dx, travelled * dy, 0)
+        manager.update()
+        for event, chunk in manager.popChunkEvents():
+            (loaded.add if event == "load" else loaded.discard)(chunk)
+
+        # Every obstacle near the ship, whether or not its chunk is loaded
+        cx = int(ship.getX() // chunkWorldSize)
+        cy = int(ship.getY() // chunkWorldSize)
+        for x in range(cx - reach, cx + reach + 1):
+            for y in range(cy - reach, cy + reach + 1):
+                if (x, y) in loaded:
+                    continue
+                if (x, y) not in placed:
+                    rows = worldGen.generate_chunk(x, y, worldGen.threshold)
+                    placed[x, y] = place_obstacles((x, y), rows, worldGen.CHUNK_SIZE)[1]
+                positions = placed[x, y]
+                if not len(positions):
+                    continue
+                offsets = positions[:, :2] - (ship.getX(), ship.getY())
+                nearest = np.hypot(offsets[:, 0], offsets[:, 1]).min()
+                if nearest <= radius:
+                    return travelled, (x, y), nearest
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--distance", type=float, default=3000)
+    parser.add_argument("--step", type=float, default=20)
+    parser.add_argument(
+        "--radius",
+        type=float,
+        default=(RENDER_DISTANCE - 1) * CLIENT_WORLD["chunk_size"] * OBSTACLE_SPACING,
+        help="world units around the ship that must stay loaded",
+    )
+    args = parser.parse_args()
+
+    failed = False
+    for heading in HEADINGS:
+        miss = fly(heading, args.distance, args.step, args.radius)
+        if miss is None:
+            print(f"heading {heading:>3}: ok")
+        else:
+            travelled, chunk, nearest = miss
+            print(
+                f"heading {heading:>3}: chunk {chunk} not loaded after "
+                f"{travelled:.0f} units, obstacle {nearest:.0f} units from the ship"
+            )
+            failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,86 +1,563 @@
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from time import time
+import json
+import math
+import os
+import sqlite3
+import threading
+import numpy as np
 import opensimplex as opsx
 
+# Columns of a generated chunk: voxel i, voxel j, terrain noise, and the two
+# placement noises (offset inside the voxel, z jitter) for the obstacle there
+CHUNK_COLUMNS = 5
+# Noise plane the z jitter is sampled from, away from the offset noise at w=0
+JITTER_PLANE = 50
+# World units between neighbouring voxels once obstacles are placed
+OBSTACLE_SPACING = 25
+# WorldGen settings the client flies with. bakeTiles bakes with the same
+# ones, load_tiles ignores tiles baked with any others
+CLIENT_WORLD = {"threshold": -1, "chunk_size": 6, "voxel_scale": 1, "noise_scale": 1}
+
+
+class ChunkCache:
+    """
+    Storage behind WorldGen.GENERATED_CHUNKS. The most recently used chunks
+    stay in memory up to `budget` bytes; older ones spill to a SQLite file
+    keyed by (seed, generation settings, chunk_x, chunk_y) and are read back
+    when touched again. The file belongs to this process and starts empty:
+    by default it is a private SQLite temporary file, deleted on exit, so
+    clients on one machine never share or lock it.
+    """
+
+    def __init__(self, seed, settings, budget=32 * 1024 * 1024, path=""):
+        self.seed = seed
+        self.settings = settings  # JSON of the other WorldGen parameters
+        self.budget = budget
+        self.path = path
+        self.chunks = OrderedDict()  # (x, y) -> array, least recently used first
+        self.size = 0
+        self.spilled = set()  # (x, y) on disk for the current seed
+        self.db = None  # opened on first spill
+        self.lock = threading.Lock()
+
+    def _connect(self):
+        if self.db is None:
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self.db = sqlite3.connect(self.path, check_same_thread=False)
+            self.db.execute("DROP TABLE IF EXISTS chunks")
+            self.db.execute(
+                "CREATE TABLE chunks "
+                "(seed INTEGER, settings TEXT, x INTEGER, y INTEGER, data BLOB, "
+                "PRIMARY KEY (seed, settings, x, y))"
+            )
+        return self.db
+
+    def _spill(self, key, chunk):
+        try:
+            self._connect().execute(
+                "INSERT OR REPLACE INTO chunks VALUES (?, ?, ?, ?, ?)",
+                (
+                    self.seed,
+                    self.settings,
+                    key[0],
+                    key[1],
+                    chunk.astype(np.float64).tobytes(),
+                ),
+            )
+        except sqlite3.Error as e:
+            # Dropped instead, the chunk is generated again when needed
+            print(f"Error spilling chunk {key} to {self.path or 'temp file'}: {e}")
+            return
+        self.spilled.add(key)
+
+    def _commit(self):
+        if self.db is not None:
+            try:
+                self.db.commit()
+            except sqlite3.Error as e:
+                print(f"Error committing chunk cache: {e}")
+
+    def _evict(self):
+        while self.size > self.budget and len(self.chunks) > 1:
+            key, chunk = self.chunks.popitem(last=False)
+            self.size -= chunk.nbytes
+            if key not in self.spilled:
+                self._spill(key, chunk)
+        self._commit()
+
+    def set_seed(self, seed):
+        with self.lock:
+            if seed == self.seed:
+                return
+            for key, chunk in self.chunks.items():
+                if key not in self.spilled:
+                    self._spill(key, chunk)
+            self._commit()
+            self.chunks.clear()
+            self.size = 0
+            self.seed = seed
+            self.spilled = set()
+            if self.db is not None:
+                self.spilled = set(
+                    self.db.execute(
+                        "SELECT x, y FROM chunks WHERE seed = ? AND settings = ?",
+                        (self.seed, self.settings),
+                    )
+                )
+
+    def __contains__(self, key):
+        return key in self.chunks or key in self.spilled
+
+    def __len__(self):
+        return len(self.chunks.keys() | self.spilled)
+
+    def __getitem__(self, key):
+        with self.lock:
+            chunk = self.chunks.get(key)
+            if chunk is not None:
+                self.chunks.move_to_end(key)
+                return chunk
+            row = None
+            if key in self.spilled:
+                try:
+                    row = (
+                        self._connect()
+                        .execute(
+                            "SELECT data FROM chunks "
+                            "WHERE seed = ? AND settings = ? AND x = ? AND y = ?",
+                            (self.seed, self.settings, key[0], key[1]),
+                        )
+                        .fetchone()
+                    )
+                except sqlite3.Error as e:
+                    print(f"Error reading spilled chunk {key}: {e}")
+                if row is None:
+                    self.spilled.discard(key)
+            if row is None:
+                raise KeyError(key)
+            chunk = np.frombuffer(row[0], dtype=np.float64).reshape(-1, CHUNK_COLUMNS)
+            self.chunks[key] = chunk
+            self.size += chunk.nbytes
+            self._evict()
+            return chunk
+
+    def __setitem__(self, key, chunk):
+        with self.lock:
+            old = self.chunks.pop(key, None)
+            if old is not None:
+                self.size -= old.nbytes
+            self.spilled.discard(key)
+            self.chunks[key] = chunk
+            self.size += chunk.nbytes
+            self._evict()
+
+
+TILE_MAGIC = b"SLPTILE2"
+# Noise layers stored per tile, in the order WorldGen.get_noise_layers returns
+TILE_LAYERS = 3
+
+
+def tile_path(tile_dir, seed):
+    return os.path.join(tile_dir, f"{seed}.tiles")
+
+
+def write_tiles(worldGen, x0, y0, width, height, path):
+    """
+    Bake the raw noise layers of chunks [x0, x0 + width) x [y0, y0 + height)
+    into a tile file: magic, a JSON header, then a float64 array indexed
+    [chunk_x - x0, chunk_y - y0, layer, i, j] that read_tiles maps straight
+    from disk.
+    """
+    n = worldGen.CHUNK_SIZE // worldGen.VOX_SC
+    offsets = np.arange(0, worldGen.CHUNK_SIZE, worldGen.VOX_SC)
+    header = json.dumps(
+        {
+            "seed": worldGen.seed,
+            "chunk_size": n,
+            "voxel_scale": worldGen.VOX_SC,
+            "noise_scale": worldGen.NOISE_SCALE * worldGen.VOX_SC,
+            "x0": x0,
+            "y0": y0,
+            "width": width,
+            "height": height,
+            "layers": TILE_LAYERS,
+        }
+    ).encode()
+    data_offset = -(-(len(TILE_MAGIC) + 4 + len(header)) // 64) * 64
+    shape = (width, height, TILE_LAYERS, n, n)
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(TILE_MAGIC)
+        f.write(len(header).to_bytes(4, "little"))
+        f.write(header)
+        f.truncate(data_offset + int(np.prod(shape)) * 8)
+    tiles = np.memmap(
+        path, dtype=np.float64, mode="r+", offset=data_offset, shape=shape
+    )
+    ys = (y0 * worldGen.CHUNK_SIZE) + np.arange(
+        0, height * worldGen.CHUNK_SIZE, worldGen.VOX_SC
+    )
+    # One noise call per column of chunks, split back into per-chunk tiles
+    for cx in range(width):
+        layers = worldGen.get_noise_layers(
+            (x0 + cx) * worldGen.CHUNK_SIZE + offsets, ys
+        )
+        tiles[cx] = layers.reshape(TILE_LAYERS, n, height, n).transpose(2, 0, 1, 3)
+    tiles.flush()
+    del tiles
+
+
+def read_tiles(path):
+    """Header dict and read-only memory-mapped noise array of a tile file."""
+    with open(path, "rb") as f:
+        if f.read(len(TILE_MAGIC)) != TILE_MAGIC:
+            raise ValueError(f"Not a current world tile file, rebake it: {path}")
+        length = int.from_bytes(f.read(4), "little")
+        header = json.loads(f.read(length))
+    data_offset = -(-(len(TILE_MAGIC) + 4 + length) // 64) * 64
+    n = header["chunk_size"]
+    tiles = np.memmap(
+        path,
+        dtype=np.float64,
+        mode="r",
+        offset=data_offset,
+        shape=(header["width"], header["height"], header["layers"], n, n),
+    )
+    return header, tiles
+
 
 class WorldGen:
     def __init__(
-        self, threshold, chunk_size=16, voxel_scale=1, noise_scale=1, seed=None
+        self,
+        threshold,
+        chunk_size=16,
+        voxel_scale=1,
+        noise_scale=1,
+        seed=None,
+        cache_budget=32 * 1024 * 1024,
+        cache_path="",
+        tile_dir="tiles",
     ):
         self.threshold = threshold
-        self.GENERATED_CHUNKS: dict[tuple[int, int], list[tuple[int, int, float]]] = {}
         self.CHUNK_SIZE = chunk_size * voxel_scale
         self.VOX_SC = voxel_scale
         self.NOISE_SCALE = noise_scale / self.VOX_SC
         self.seed = seed if seed is not None else int(time() * 1000)
+        self.noise = opsx.OpenSimplex(seed=self.seed)
+        # (chunk_x, chunk_y) -> (N, CHUNK_COLUMNS) array, one row per voxel
+        # above threshold
+        settings = json.dumps([threshold, chunk_size, voxel_scale, noise_scale])
+        self.GENERATED_CHUNKS = ChunkCache(
+            self.seed, settings, cache_budget, cache_path
+        )
+        self.tile_dir = tile_dir
+        self.load_tiles()
 
     def set_seed(self, seed):
         self.seed = seed
         opsx.seed(seed=seed)
+        self.noise = opsx.OpenSimplex(seed=seed)
+        self.GENERATED_CHUNKS.set_seed(seed)
+        self.load_tiles()
+
+    def load_tiles(self):
+        """Map the baked tile file for the current seed, if there is one."""
+        self.tiles = None
+        path = tile_path(self.tile_dir, self.seed) if self.tile_dir else None
+        if path is None or not os.path.exists(path):
+            return
+        try:
+            header, tiles = read_tiles(path)
+        except Exception as e:
+            print(f"Error loading world tiles {path}: {e}")
+            return
+        if (
+            header["chunk_size"] == self.CHUNK_SIZE // self.VOX_SC
+            and header["voxel_scale"] == self.VOX_SC
+            and math.isclose(header["noise_scale"], self.NOISE_SCALE * self.VOX_SC)
+        ):
+            self.tiles = tiles
+            self.tile_origin = (header["x0"], header["y0"])
+
+    def has_tile(self, x, y):
+        if self.tiles is None:
+            return False
+        tx, ty = x - self.tile_origin[0], y - self.tile_origin[1]
+        return 0 <= tx < self.tiles.shape[0] and 0 <= ty < self.tiles.shape[1]
 
     def get_noise_point(self, x, y, z, seed):
-        opsx.seed(seed=seed)
         scalar = 3 * self.NOISE_SCALE
-        return opsx.noise4(x=x / scalar, y=y / scalar, z=0, w=z / scalar)
-
-    def generate_chunk(self, x, y, threshold):
-        chunk = []
-        for i in range(0, self.CHUNK_SIZE, self.VOX_SC):
-            for j in range(0, self.CHUNK_SIZE, self.VOX_SC):
-                noise = self.get_noise_point(
-                    (x * self.CHUNK_SIZE) + i, (y * self.CHUNK_SIZE) + j, 0, self.seed
-                )
-                if noise > threshold:
-                    chunk.append((i, j, noise))
-        return chunk
+        if seed != self.seed:
+            opsx.seed(seed=seed)
+            return opsx.noise4(x=x / scalar, y=y / scalar, z=0, w=z / scalar)
+        return self.noise.noise4(x=x / scalar, y=y / scalar, z=0, w=z / scalar)
+
+    def get_noise_grid(self, xs, ys, z=0):
+        """
+        Noise for every (x, y) pair of the two coordinate vectors in one call,
+        indexed [x, y], with the same scaling as get_noise_point.
+        """
+        scalar = 3 * self.NOISE_SCALE
+        noise = self.noise.noise4array(
+            np.asarray(xs, dtype=np.float64) / scalar,
+            np.asarray(ys, dtype=np.float64) / scalar,
+            np.zeros(1),
+            np.array([z / scalar]),
+        )
+        return noise[0, 0].T
+
+    def get_noise_layers(self, xs, ys):
+        """
+        Terrain noise and the two placement noises for every (x, y) pair,
+        stacked [layer, x, y]. Placement samples the same field 100x finer,
+        which is what renderTerrain used to ask get_noise_point for per object.
+        """
+        xs = np.asarray(xs, dtype=np.float64)
+        ys = np.asarray(ys, dtype=np.float64)
+        return np.stack(
+            (
+                self.get_noise_grid(xs, ys),
+                self.get_noise_grid(xs * 100, ys * 100),
+                self.get_noise_grid(xs * 100, ys * 100, JITTER_PLANE),
+            )
+        )
+
+    def generate_chunk(self, x, y, threshold) -> np.ndarray:
+        offsets = np.arange(0, self.CHUNK_SIZE, self.VOX_SC)
+        if self.has_tile(x, y):
+            layers = self.tiles[x - self.tile_origin[0], y - self.tile_origin[1]]
+        else:
+            layers = self.get_noise_layers(
+                (x * self.CHUNK_SIZE) + offsets, (y * self.CHUNK_SIZE) + offsets
+            )
+        noise, placement, jitter = layers
+        i, j = np.nonzero(noise > threshold)
+        return np.column_stack(
+            (offsets[i], offsets[j], noise[i, j], placement[i, j], jitter[i, j])
+        )
+
+
+def place_obstacles(chunk, rows, chunk_size):
+    """
+    World coordinates, obstacle positions and spawn indices (0..1) for the
+    rows of a generated chunk, placed from its precomputed noise columns.
+    """
+    rows = np.asarray(rows)
+    xs, ys = rows[:, 0], rows[:, 1]
+    coords3D = np.stack(
+        [chunk[0] * chunk_size + xs, chunk[1] * chunk_size + ys, np.zeros_like(xs)],
+        axis=1,
+    )
+    pointIndices = (rows[:, 2] + 1) / 2
+    offsets = 10 + (rows[:, 3] + 2) * 50
+    positions = np.stack(
+        [
+            (coords3D[:, 0] * OBSTACLE_SPACING) + offsets,
+            (coords3D[:, 1] * OBSTACLE_SPACING) + np.mod(coords3D[:, 1], offsets) / 20,
+            rows[:, 4] * 0.5,  # Z offset to avoid z-fighting
+        ],
+        axis=1,
+    )
+    return coords3D, positions, pointIndices
+
+
+def _generate_chunk_job(settings, x, y):
+    # Runs in a worker process; WorldGen instances are cheap, so build one per job
+    threshold, chunk_size, voxel_scale, noise_scale, seed, tile_dir = settings
+    worldGen = WorldGen(
+        threshold, chunk_size, voxel_scale, noise_scale, seed, tile_dir=tile_dir
+    )
+    return worldGen.generate_chunk(x, y, threshold)
 
 
 class WorldManager:
     def __init__(
-        self, WorldGen: WorldGen, renderObject, renderDistance=2, scale_multiplier=1
+        self,
+        WorldGen: WorldGen,
+        renderObject,
+        renderDistance=2,
+        scale_multiplier=1,
+        prefetchDistance=1,
+        workers=None,
     ):
         self.WorldGen = WorldGen
         self.voxelScale = WorldGen.VOX_SC
         self.renderObject = renderObject
         self.renderDistance: int = renderDistance
+        self.prefetchDistance: int = prefetchDistance
         self.activeChunks = set()
-        self.lastActiveChunks = set()
-        self.newChunks = set()
-        self.lastNewChunks = set()
-        self.generatedChunk = False
         self.scale_multiplier = scale_multiplier
+        # workers=0 generates chunks inline on the calling thread instead
+        self.executor = (
+            ProcessPoolExecutor(max_workers=workers) if workers != 0 else None
+        )
+        self.pendingChunks = {}  # (x, y) -> Future
+        self.lastPos = None
+        self.heading = (0.0, 0.0)
+        self.centerChunk = None  # chunk the ship was in at the last update
+        # ("load" | "unload", (x, y)) in the order chunks entered/left activeChunks
+        self.chunkEvents = deque()
+
+    def popChunkEvents(self):
+        events = []
+        while self.chunkEvents:
+            events.append(self.chunkEvents.popleft())
+        return events
+
+    def shutdown(self):
+        if self.executor is not None:
+            for future in self.pendingChunks.values():
+                future.cancel()
+            self.pendingChunks.clear()
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+    def _settings(self):
+        worldGen = self.WorldGen
+        return (
+            worldGen.threshold,
+            worldGen.CHUNK_SIZE // worldGen.VOX_SC,
+            worldGen.VOX_SC,
+            worldGen.NOISE_SCALE * worldGen.VOX_SC,
+            worldGen.seed,
+            worldGen.tile_dir,
+        )
+
+    def _updateHeading(self, pos):
+        if self.lastPos is not None:
+            dx, dy = pos[0] - self.lastPos[0], pos[1] - self.lastPos[1]
+            length = math.hypot(dx, dy)
+            if length > 0:
+                self.heading = (dx / length, dy / length)
+        self.lastPos = (pos[0], pos[1])
+
+    def _chunkPriority(self, chunk, activeChunk):
+        # Nearest first, and ahead of the ship before behind it
+        dx, dy = chunk[0] - activeChunk[0], chunk[1] - activeChunk[1]
+        return math.hypot(dx, dy) - 0.5 * (dx * self.heading[0] + dy * self.heading[1])
+
+    def _inRenderRange(self, chunk):
+        return (
+            self.centerChunk is not None
+            and abs(chunk[0] - self.centerChunk[0]) <= self.renderDistance
+            and abs(chunk[1] - self.centerChunk[1]) <= self.renderDistance
+        )
+
+    def _loadChunk(self, chunk):
+        if chunk not in self.activeChunks:
+            self.activeChunks.add(chunk)
+            self.chunkEvents.append(("load", chunk))
+
+    def _unloadChunk(self, chunk):
+        if chunk in self.activeChunks:
+            self.activeChunks.remove(chunk)
+            self.chunkEvents.append(("unload", chunk))
+
+    def _chunkReady(self, chunk, data):
+        self.WorldGen.GENERATED_CHUNKS[chunk] = data
+        if self._inRenderRange(chunk):
+            self._loadChunk(chunk)
+
+    def _publishFinished(self):
+        for chunk, future in list(self.pendingChunks.items()):
+            if future.done():
+                del self.pendingChunks[chunk]
+                if future.cancelled():
+                    continue
+                try:
+                    data = future.result()
+                except BrokenProcessPool as e:
+                    if self.executor is not None:
+                        self._dropExecutor(e)
+                    data = None
+                except Exception as e:
+                    print(f"Error generating chunk {chunk} in a worker: {e}")
+                    data = None
+                if data is None:
+                    data = self.WorldGen.generate_chunk(*chunk, self.WorldGen.threshold)
+                self._chunkReady(chunk, data)
+
+    def _dropExecutor(self, error):
+        # A dead pool fails every job, each of which is then generated
+        # inline by _publishFinished; new requests skip the pool
+        print(f"Chunk worker pool stopped ({error}), generating chunks inline")
+        executor, self.executor = self.executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+    def _requestChunks(self, chunks, activeChunk):
+        settings = self._settings()
+        chunks.sort(key=lambda chunk: self._chunkPriority(chunk, activeChunk))
+        for x, y in chunks:
+            # Baked tiles are a plain read, not worth a round trip to a worker
+            if self.executor is not None and not self.WorldGen.has_tile(x, y):
+                try:
+                    self.pendingChunks[(x, y)] = self.executor.submit(
+                        _generate_chunk_job, settings, x, y
+                    )
+                    continue
+                except BrokenProcessPool as e:
+                    self._dropExecutor(e)
+            self._chunkReady(
+                (x, y), self.WorldGen.generate_chunk(x, y, self.WorldGen.threshold)
+            )
+
+    @staticmethod
+    def _windowDifference(center, other, reach):
+        """
+        Chunks within `reach` of `center` but not within `reach` of `other`,
+        i.e. the strips that entered (or, swapped, left) the square window.
+        """
+        chunks = []
+        ys = range(center[1] - reach, center[1] + reach + 1)
+        for x in range(center[0] - reach, center[0] + reach + 1):
+            if other is None or abs(x - other[0]) > reach:
+                chunks.extend((x, y) for y in ys)
+            else:
+                chunks.extend((x, y) for y in ys if abs(y - other[1]) > reach)
+        return chunks
 
     def update(self):
-        self.generatedChunk = False
+        pos = self.renderObject.getPos()
+        x, y = pos[0], pos[1]
+        self._updateHeading((x, y))
+        chunkSize, voxelScale = self.WorldGen.CHUNK_SIZE, self.voxelScale
         activeChunk = (
-            (self.renderObject.getPos() // self.WorldGen.CHUNK_SIZE // self.voxelScale)
-            * self.scale_multiplier
-            // self.voxelScale
+            int(x // chunkSize // voxelScale * self.scale_multiplier // voxelScale),
+            int(y // chunkSize // voxelScale * self.scale_multiplier // voxelScale),
         )
-        activeChunk = [int(activeChunk[0]), int(activeChunk[1])]
-        for x in range(
-            activeChunk[0] - self.renderDistance,
-            activeChunk[0] + self.renderDistance + 1,
-        ):
-            for y in range(
-                activeChunk[1] - self.renderDistance,
-                activeChunk[1] + self.renderDistance + 1,
-            ):
-                x, y = int(x / self.voxelScale), int(y / self.voxelScale)
-                if not self.generatedChunk:
-                    if (x, y) in self.WorldGen.GENERATED_CHUNKS:
-                        self.activeChunks.add((x, y))
-                    else:
-                        self.WorldGen.GENERATED_CHUNKS[(x, y)] = (
-                            self.WorldGen.generate_chunk(x, y, self.WorldGen.threshold)
-                        )
-                        self.newChunks.add((x, y))
-                        self.generatedChunk = True
-
-        for x, y in self.activeChunks.copy():
-            if (
-                x < activeChunk[0] - self.renderDistance
-                or x > activeChunk[0] + self.renderDistance
-                or y < activeChunk[1] - self.renderDistance
-                or y > activeChunk[1] + self.renderDistance
+        self._publishFinished()
+        if activeChunk == self.centerChunk:
+            return
+        lastChunk, self.centerChunk = self.centerChunk, activeChunk
+
+        # Only the strips that crossed the window edges need any work
+        reach = self.renderDistance + self.prefetchDistance
+        if lastChunk is not None:
+            for chunk in self._windowDifference(
+                lastChunk, activeChunk, self.renderDistance
             ):
-                self.activeChunks.remove((x, y))
+                self._unloadChunk(chunk)
+            # Drop requests the ship has already flown away from
+            for chunk in self._windowDifference(lastChunk, activeChunk, reach):
+                future = self.pendingChunks.get(chunk)
+                if future is not None and future.cancel():
+                    del self.pendingChunks[chunk]
+        for chunk in self._windowDifference(
+            activeChunk, lastChunk, self.renderDistance
+        ):
+            if chunk in self.WorldGen.GENERATED_CHUNKS:
+                self._loadChunk(chunk)
+
+        missing = [
+            chunk
+            for chunk in self._windowDifference(activeChunk, lastChunk, reach)
+            if chunk not in self.WorldGen.GENERATED_CHUNKS
+            and chunk not in self.pendingChunks
+        ]
+        self._requestChunks(missing, activeChunk)
@@ -19,6 +19,7 @@ from panda3d.core import (
 )
 import direct.stdpy.threading as threading
 from socketServer import (
+    MSG,
     send_message,
     iter_messages,
     launch_server,
@@ -102,6 +103,13 @@ class serverProgram(ShowBase):
         self.setBackgroundColor(0, 0, 0)
         self.disableMouse()
         self.client_info = {"MONITOR_INDEX": 0}
+        self.messageHandlers = {
+            MSG.CLIENT_INIT: lambda wsock, payload: self.runClientConfig(wsock),
+            MSG.CLIENT_INFO: lambda wsock, payload: self.setClientInfo(*payload),
+            MSG.CLIENT_READY: lambda wsock, payload: self.setPreSimulation(),
+            MSG.UPDATE_DATA: lambda wsock, payload: self.updateData(payload),
+            MSG.NEW_OBJECT: lambda wsock, payload: self.newObject(payload),
+        }
         self.accept("q", self.quit)
         self.taskMgr.add(self.client_loop, "client_loop")
         self.thorium_connection = Connection()
@@ -192,45 +200,34 @@ class serverProgram(ShowBase):
         self.currentMapNodeCount = 0
 
     def client_loop(self, task):
-        for entry in iter_messages():
-            wsock, message = entry if isinstance(entry, tuple) else (None, entry)
-            if message == "CLIENT_INIT":
-                self.runClientConfig(wsock)
-            elif message.startswith("CLIENT_INFO"):
-                info_id = message.split("||+")[1]
-                client_info = message.split("||+")[2]
-                self.client_info[info_id] = loads(client_info)
-                if info_id == "MONITOR_INDEX":
-                    self.savedClientData["MONITOR_INDEX"] = self.client_info[
-                        "MONITOR_INDEX"
-                    ]
-                elif info_id == "SEED":
-                    self.savedClientData["SEED"] = self.client_info["SEED"]
-                    self.seedEntry.set(str(self.savedClientData["SEED"]))
-                    LerpColorScaleInterval(
-                        self.seedEntry,
-                        0.5,
-                        Vec4(1, 1, 1, 1),
-                        Vec4(0, 1, 0, 1),
-                    ).start()
-            elif message == "CLIENT_READY":
-                self.setPreSimulation()
-            elif message.startswith("UPDATE_DATA"):
-                data = message.split("||+")[1]
-                self.updateData(loads(data))
-            elif message.startswith("NEW_OBJECT"):
-                data = message.split("||+")[1]
-                self.newObject(loads(data))
-            else:
-                print(f"SERVER: Received unknown message: {message}")
+        for wsock, msgType, payload in iter_messages():
+            handler = self.messageHandlers.get(msgType)
+            if handler is None:
+                print(f"SERVER: Received unknown message: {msgType!r}")
+                continue
+            handler(wsock, payload)
         return task.cont
 
+    def setClientInfo(self, info_id, client_info):
+        self.client_info[info_id] = client_info
+        if info_id == "MONITOR_INDEX":
+            self.savedClientData["MONITOR_INDEX"] = self.client_info["MONITOR_INDEX"]
+        elif info_id == "SEED":
+            self.savedClientData["SEED"] = self.client_info["SEED"]
+            self.seedEntry.set(str(self.savedClientData["SEED"]))
+            LerpColorScaleInterval(
+                self.seedEntry,
+                0.5,
+                Vec4(1, 1, 1, 1),
+                Vec4(0, 1, 0, 1),
+            ).start()
+
     def quit(self):
         print("SERVER: Exiting server program...")
         self.userExit()
 
     def client_config(self, wsock, data):
-        send_message("CLIENT_CONFIG||+" + data, target_client=wsock)
+        send_message(MSG.CLIENT_CONFIG, data, target_client=wsock)
 
     def updateData(self, data):
         self.savedClientData["OBJECTS"]["SHIP"]["position"] = data["ship"]["pos"]
@@ -416,7 +413,7 @@ class serverProgram(ShowBase):
             scale=0.1,
             pos=(0, 0, -0.92),
             command=lambda: [
-                send_message("BUILD_WORLD", target_client=wsock),
+                send_message(MSG.BUILD_WORLD, target_client=wsock),
                 self.startButton.setText("Loading..."),
                 self.loadConfigDropdown.destroy(),
             ][0],
@@ -632,10 +629,7 @@ class serverProgram(ShowBase):
             0,
         ]
         obj_data["customSetType"] = True
-        send_message(
-            "NEW_OBJECT||+" + dumps(obj_data),
-            target_client=None,
-        )
+        send_message(MSG.NEW_OBJECT, obj_data, target_client=None)
         self.closePlaceMenu()
 
     def closePlaceMenu(self):
@@ -702,7 +696,7 @@ class serverProgram(ShowBase):
         self.accept("mouse3", lambda: None)
 
     def simulationStart(self):
-        send_message("START_SIMULATION"),
+        send_message(MSG.START_SIMULATION),
         self.beginSimulationButton.destroy()
         self.taskMgr.add(self.update, "update_thruster_rotation")
 
@@ -710,7 +704,7 @@ class serverProgram(ShowBase):
 
     def update(self, task):
         distance_changed = self.thorium_connection.get_thruster_loc_rot()
-        send_message("UPDATE_THORIUM_SHIP_POSITION||+" + dumps(distance_changed))
+        send_message(MSG.UPDATE_THORIUM_SHIP_POSITION, distance_changed)
         return task.cont
 
 
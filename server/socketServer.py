@@ -2,26 +2,63 @@ import direct.stdpy.threading as threading
 from time import sleep
 import websockets as ws
 import asyncio
-import json
-import queue
+import os
+import sys
+
+# The wire protocol lives once, in the top-level shared/ folder
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "shared")
+)
+from wireProtocol import MSG, STATE_TYPES, decode, drop_superseded, encode, pack_frames
 
 inbound = []
-clients = {}  # websocket -> outbound queue
+# websocket -> outbound asyncio.Queue of records, (type,) placeholders for
+# STATE_TYPES, or None to close the sender
+clients = {}
+latest = {}  # websocket -> {message type: newest unsent record of that type}
+loop = None  # event loop the server runs on, set by main()
+
+
+def _enqueue(client, message, key=None):
+    # Queues belong to the server loop; other threads hand messages over
+    # through call_soon_threadsafe, which also wakes the sender immediately
+    q = clients.get(client)
+    if q is None:
+        return  # unregistered since the caller looked it up
+    if key is None:
+        loop.call_soon_threadsafe(q.put_nowait, message)
+    else:
+        loop.call_soon_threadsafe(_put_latest, client, key, message)
+
+
+def _put_latest(client, key, message):
+    if client not in clients:
+        return
+    pending = latest[client]
+    if key not in pending:
+        clients[client].put_nowait((key,))
+    pending[key] = message
 
 
-def send_message(message, target_client=None):
+def send_message(msgType, payload=None, target_client=None):
+    """
+    Queue a message for one client, or all of them. STATE_TYPES are
+    latest-value state: one still waiting to be sent is replaced by the next
+    of the same type, keeping its place in the queue.
+    """
     try:
-        message = json.dumps(message)
+        message = encode(msgType, payload)
     except Exception as e:
-        raise ValueError("Message must be a JSON encodable object") from e
+        raise ValueError(f"Payload does not fit the {msgType!r} layout") from e
+    key = msgType if msgType in STATE_TYPES else None
     if target_client:
         if target_client in clients:
-            clients[target_client].put(message)
+            _enqueue(target_client, message, key)
         else:
             print(f"SERVER: Target client not found: {target_client}")
     else:
-        for wsock, q in clients.items():
-            q.put(message)
+        for wsock in list(clients):
+            _enqueue(wsock, message, key)
 
 
 def iter_messages():
@@ -29,18 +66,26 @@ def iter_messages():
     inbound.clear()
     if not val:
         return []
-    # Return (websocket, message) tuples for serverApp to know the sender
-    return [(wsock, json.loads(msg)) for wsock, msg in val]
+    # Return (websocket, type, payload) for serverApp to know the sender
+    messages = [
+        (wsock, msgType, payload)
+        for wsock, frame in val
+        for msgType, payload in decode(frame)
+    ]
+    # State messages supersede each other per client
+    return drop_superseded(messages, typeIndex=1)
 
 
 def register_client(client):
-    clients[client] = queue.Queue()
+    clients[client] = asyncio.Queue()
+    latest[client] = {}
     print(f"SERVER: Client registered: {client.remote_address}")
 
 
 def unregister_client(client):
     if client in clients:
-        clients.pop(client, None)
+        clients.pop(client).put_nowait(None)
+        latest.pop(client, None)
         if disconnect_callback:
             disconnect_callback()
         print(f"SERVER: Client unregistered: {client.remote_address}")
@@ -65,6 +110,7 @@ def register_disconnect_callback(callback):
 
 
 async def handle_client(websocket):
+    registered = asyncio.Event()
 
     async def read_incoming():
         while True:
@@ -72,6 +118,7 @@ async def handle_client(websocket):
                 message = await websocket.recv()
                 if message == "WS_CLIENT_REGISTER":
                     register_client(websocket)
+                    registered.set()
                 elif message:
                     inbound.append((websocket, message))
             except ws.ConnectionClosed:
@@ -84,17 +131,26 @@ async def handle_client(websocket):
                 break
 
     async def send_outbound():
-        while True:
-            if websocket not in clients:
-                await asyncio.sleep(1 / 30)
-                continue
-            q = clients[websocket]
+        await registered.wait()
+        q = clients.get(websocket)
+        pending = latest.get(websocket)
+        while q is not None:
+            # Sleep until something is queued, then send everything pending
+            items = [await q.get()]
+            while not q.empty():
+                items.append(q.get_nowait())
+            closing = None in items
+            if closing:
+                items = items[: items.index(None)]
+            batch = [
+                pending.pop(item[0]) if isinstance(item, tuple) else item
+                for item in items
+            ]
             try:
-                if not q.empty():
-                    message = q.get()
-                    await websocket.send(message)
-                else:
-                    await asyncio.sleep(1 / 60)
+                for frame in pack_frames(batch):
+                    await websocket.send(frame)
+                if closing:
+                    return
             except ws.ConnectionClosed:
                 print(
                     f"SERVER: Connection closed while sending to {websocket.remote_address}"
@@ -115,6 +171,8 @@ async def handle_client(websocket):
 
 
 async def main(ip, port):
+    global loop
+    loop = asyncio.get_running_loop()
     server = await ws.serve(handle_client, ip, port)
     print(f"SERVER: WebSocket server started on ws://{ip}:{port}")
     try:
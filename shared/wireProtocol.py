@@ -0,0 +1,225 @@
+"""
+Binary wire protocol spoken between socketClient and socketServer.
+
+A websocket frame is a run of records. Each record is a 5-byte header
+(message type, body length) followed by a body whose layout is fixed by the
+type, so poses cost a few dozen bytes instead of a JSON string inside a JSON
+string. Both apps import this one copy, socketClient and socketServer add
+this folder to sys.path.
+"""
+
+from enum import IntEnum
+import json
+import struct
+
+
+class MSG(IntEnum):
+    CLIENT_INIT = 1
+    CLIENT_INFO = 2
+    CLIENT_READY = 3
+    CLIENT_CONFIG = 4
+    BUILD_WORLD = 5
+    START_SIMULATION = 6
+    QUIT = 7
+    UPDATE_DATA = 8
+    UPDATE_THORIUM_SHIP_POSITION = 9
+    NEW_OBJECT = 10
+
+
+# Latest-value messages: an unsent one is replaced by the next of its type
+STATE_TYPES = frozenset({MSG.UPDATE_DATA, MSG.UPDATE_THORIUM_SHIP_POSITION})
+
+_header = struct.Struct("<BI")
+_pose = struct.Struct("<6f")
+_text = struct.Struct("<H")
+_objectFlags = struct.Struct("<B")
+# position, rotation, size, color; the rest of an object travels as JSON
+_objectFields = (("position", 3), ("rotation", 3), ("size", 3), ("color", 4))
+_objectLayout = struct.Struct("<" + "".join(f"{n}f" for _, n in _objectFields))
+_OBJECT_FIXED = 1
+
+
+def _packText(text):
+    data = text.encode()
+    return _text.pack(len(data)) + data
+
+
+def _unpackText(body, offset):
+    (length,) = _text.unpack_from(body, offset)
+    offset += _text.size
+    return body[offset : offset + length].decode(), offset + length
+
+
+def _encodeEmpty(payload):
+    return b""
+
+
+def _decodeEmpty(body):
+    return None
+
+
+def _encodeString(payload):
+    return payload.encode()
+
+
+def _decodeString(body):
+    return body.decode()
+
+
+def _encodeInfo(payload):
+    # (info id, JSON-encodable value)
+    infoId, value = payload
+    return _packText(infoId) + json.dumps(value).encode()
+
+
+def _decodeInfo(body):
+    infoId, offset = _unpackText(body, 0)
+    return infoId, json.loads(body[offset:])
+
+
+def _encodeShipPose(payload):
+    ship = payload["ship"]
+    return _pose.pack(*ship["pos"], *ship["rot"])
+
+
+def _decodeShipPose(body):
+    values = _pose.unpack(body)
+    return {"ship": {"pos": list(values[:3]), "rot": list(values[3:])}}
+
+
+def _encodeThrusterPose(payload):
+    # (direction {x, y, z}, rotation {yaw, pitch, roll}) as Thorium reports it
+    direction, rotation = payload
+    return _pose.pack(
+        direction["x"],
+        direction["y"],
+        direction["z"],
+        rotation["yaw"],
+        rotation["pitch"],
+        rotation["roll"],
+    )
+
+
+def _decodeThrusterPose(body):
+    x, y, z, yaw, pitch, roll = _pose.unpack(body)
+    return {"x": x, "y": y, "z": z}, {"yaw": yaw, "pitch": pitch, "roll": roll}
+
+
+def _encodeObject(payload):
+    rest = dict(payload)
+    try:
+        values = []
+        for key, n in _objectFields:
+            field = [float(v) for v in rest[key]]
+            if len(field) != n:
+                raise ValueError(key)
+            values.extend(field)
+        if not isinstance(rest["name"], str) or not isinstance(rest["id"], str):
+            raise ValueError("name")
+    except (KeyError, TypeError, ValueError):
+        # Not the usual object shape, send all of it as JSON
+        return _objectFlags.pack(0) + json.dumps(rest).encode()
+    for key, _ in _objectFields:
+        del rest[key]
+    fixed = _objectLayout.pack(*values)
+    texts = _packText(rest.pop("name")) + _packText(rest.pop("id"))
+    return _objectFlags.pack(_OBJECT_FIXED) + fixed + texts + json.dumps(rest).encode()
+
+
+def _decodeObject(body):
+    (flags,) = _objectFlags.unpack_from(body, 0)
+    offset = _objectFlags.size
+    if not flags & _OBJECT_FIXED:
+        return json.loads(body[offset:])
+    values = _objectLayout.unpack_from(body, offset)
+    offset += _objectLayout.size
+    name, offset = _unpackText(body, offset)
+    objectId, offset = _unpackText(body, offset)
+    data = json.loads(body[offset:])
+    start = 0
+    for key, n in _objectFields:
+        data[key] = list(values[start : start + n])
+        start += n
+    data["name"] = name
+    data["id"] = objectId
+    return data
+
+
+_codecs = {
+    MSG.CLIENT_INIT: (_encodeEmpty, _decodeEmpty),
+    MSG.CLIENT_INFO: (_encodeInfo, _decodeInfo),
+    MSG.CLIENT_READY: (_encodeEmpty, _decodeEmpty),
+    MSG.CLIENT_CONFIG: (_encodeString, _decodeString),
+    MSG.BUILD_WORLD: (_encodeEmpty, _decodeEmpty),
+    MSG.START_SIMULATION: (_encodeEmpty, _decodeEmpty),
+    MSG.QUIT: (_encodeEmpty, _decodeEmpty),
+    MSG.UPDATE_DATA: (_encodeShipPose, _decodeShipPose),
+    MSG.UPDATE_THORIUM_SHIP_POSITION: (_encodeThrusterPose, _decodeThrusterPose),
+    MSG.NEW_OBJECT: (_encodeObject, _decodeObject),
+}
+
+
+# Everything a sender has pending goes out as one binary websocket frame of
+# records, split so no frame passes FRAME_BYTES
+FRAME_BYTES = 256 * 1024  # well under the 1 MiB websockets frame limit
+
+
+def pack_frames(records):
+    """Join encoded records into frames of at most FRAME_BYTES."""
+    frames = []
+    pending = []
+    size = 0
+    for record in records:
+        if pending and size + len(record) > FRAME_BYTES:
+            frames.append(b"".join(pending))
+            pending = []
+            size = 0
+        pending.append(record)
+        size += len(record)
+    if pending:
+        frames.append(b"".join(pending))
+    return frames
+
+
+def drop_superseded(messages, typeIndex=0):
+    """
+    `messages` without the STATE_TYPES ones a later message replaces. Each
+    message is a tuple with its MSG at `typeIndex`; anything before it (such
+    as the sending websocket) must match too for one to replace another.
+    """
+    newest = {
+        message[: typeIndex + 1]: i
+        for i, message in enumerate(messages)
+        if message[typeIndex] in STATE_TYPES
+    }
+    return [
+        message
+        for i, message in enumerate(messages)
+        if message[typeIndex] not in STATE_TYPES
+        or newest[message[: typeIndex + 1]] == i
+    ]
+
+
+def encode(msgType, payload=None):
+    """One record: header and the body laid out for `msgType`."""
+    msgType = MSG(msgType)
+    body = _codecs[msgType][0](payload)
+    return _header.pack(msgType, len(body)) + body
+
+
+def decode(frame):
+    """(MSG, payload) for every record in a frame."""
+    messages = []
+    offset = 0
+    while offset < len(frame):
+        msgType, length = _header.unpack_from(frame, offset)
+        offset += _header.size
+        body = frame[offset : offset + length]
+        offset += length
+        try:
+            msgType = MSG(msgType)
+        except ValueError:
+            print(f"Skipping unknown message type {msgType}")
+            continue
+        messages.append((msgType, _codecs[msgType][1](body)))
+    return messages